@@ -11,11 +11,30 @@ import time
 import os
 import logging
 import json
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import contextvars
+import functools
+import glob
+import hashlib
+import heapq
+import http.server
+import itertools
+import queue
+import random
+import re
+import signal
+import struct
+import types
 import paho.mqtt.client as mqtt
 
 # ================== CONFIG ==================
 
-with open("/data/options.json") as f:
+OPTIONS_FILE = os.environ.get("CA350_OPTIONS", "/data/options.json")
+
+with open(OPTIONS_FILE) as f:
     options = json.load(f)
 
 DEBUG = options['debug'] 
@@ -35,12 +54,131 @@ mqtt_pass = os.environ.get("MQTT_PASS")
 mqtt_base_topic = options['mqtt_base_topic']
 ha_prefix = options['ha_prefix']
 
-DEVICE_INFO = {
-    "identifiers": ["ca350"],
-    "name": "CA350",
-    "manufacturer": "Zehnder",
-    "model": "Comfoair 350"
-}
+# "threads" (rx thread + paho thread) or "asyncio" (single event loop)
+RUNTIME = options.get('runtime', 'threads')
+
+# commands waiting behind the running one, further commands are dropped
+COMMAND_QUEUE_SIZE = 16
+
+# reconnects of both links: exponential backoff with jitter between these delays
+RECONNECT_MIN_DELAY = 1.0
+RECONNECT_MAX_DELAY = 60.0
+CONNECT_TIMEOUT = 10           # TCP connect to a CA350 gateway
+
+# TCP keepalive on the gateway socket: probes after 5 s of silence, every 2 s,
+# dead after 3 unanswered; unacknowledged writes give up after 10 s
+KEEPALIVE_IDLE = 5
+KEEPALIVE_INTERVAL = 2
+KEEPALIVE_PROBES = 3
+TCP_WRITE_TIMEOUT_MS = 10000
+
+# MQTT outbox: topics waiting per unit (oldest dropped beyond) and publishes
+# handed to paho but not yet written to the socket
+MQTT_OUTBOX_PER_UNIT = 100
+MQTT_INFLIGHT = 20
+
+# CC Ease emulation poll cadence: fast while a command waits for its
+# confirming frame, slower when idle but never beyond the keep-alive limit
+POLL_BURST_INTERVAL = 0.1
+POLL_BURST_WINDOW = 3.0        # seconds after a command's last write
+POLL_KEEPALIVE = 2.0           # longest gap between polls the bridge allows
+POLL_IDLE_INTERVAL = min(max(float(options.get('poll_idle_interval', 1.0)), POLL_BURST_INTERVAL), POLL_KEEPALIVE)
+CCEASE_STAT_INTERVAL = 5.0
+
+# liveness: nothing received for this long and the gateway link is reopened
+# (power-cycled gateway, half-open socket); 0 = by mode: the ComfoSense talks
+# to the unit about once a second, in CC Ease emulation the unit answers our polls
+LINK_TIMEOUT = float(options.get('link_timeout', 0))
+LINK_TIMEOUT_COMFOSENSE = 10.0
+LINK_TIMEOUT_EMULATION = 3 * POLL_KEEPALIVE
+
+# refresh requests: "15m", "every 2h", "daily 06:00", "off"
+HOURS_SCHEDULE = options.get('hours_schedule', 'daily 06:00')
+DELAY_TIMES_SCHEDULE = options.get('delay_times_schedule', 'daily 06:00:04')
+
+# republish all known values every N seconds, 0 = publish every value as received
+PUBLISH_HEARTBEAT = int(options.get('publish_heartbeat', 300))
+
+# one JSON message per frame group (status/fans, status/temperatures, ...) instead of one per value
+JSON_STATE = bool(options.get('json_state', False))
+
+# receive buffer, compacted when less than RX_CHUNK bytes are left at the end
+RX_BUF_SIZE = 4096
+RX_CHUNK = 256
+
+# persistent files (captures) live next to the options file
+DATA_DIR = os.environ.get("CA350_DATA", os.path.dirname(OPTIONS_FILE))
+
+# raw RX capture for dev/replay_capture.py, size in MB over all rotated files
+CAPTURE = bool(options.get('capture', False))
+CAPTURE_SIZE_MB = float(options.get('capture_size_mb', 20))
+CAPTURE_QUEUE_SIZE = 1024       # chunks waiting for the writer thread, more are dropped
+CAPTURE_FILES = 4
+
+# last delay times and operating hours in DATA_DIR/<unit>_state.json, loaded at
+# startup so settings commands work before the unit answered; written at most once a minute
+STATE_SNAPSHOT = bool(options.get('state_snapshot', True))
+STATE_SAVE_INTERVAL = 60
+
+# last raw frames kept in memory, dumped to DATA_DIR on request, checksum error bursts and disconnects
+FRAME_LOG_SIZE = int(options.get('frame_log_size', 256))
+FRAME_LOG_BURST = 5             # checksum errors ...
+FRAME_LOG_BURST_WINDOW = 10     # ... within this many seconds trigger a dump
+FRAME_LOG_DUMP_INTERVAL = 60    # at most one automatic dump per minute
+FRAME_LOG_KEEP = 10             # dump files kept
+
+# OpenMetrics endpoint http://<host>:<port>/metrics, 0 = off
+METRICS_PORT = int(options.get('metrics_port', 0))
+
+# command traces as OpenTelemetry (OTLP JSON) lines in DATA_DIR/ca350_traces.jsonl
+TRACE_SPANS = bool(options.get('trace_spans', False))
+TRACE_FILE_MAX = 5 * 1024 * 1024    # rotated to .1 beyond this
+TRACE_QUEUE_SIZE = 1000             # span lines waiting for the writer thread, more are dropped
+
+# frames written within this many ms leave in one TCP segment, 0 = every frame on its own;
+# ACKs, button presses and command frames are sent right away
+TX_BATCH_WINDOW = min(max(float(options.get('tx_batch_ms', 5)), 0.0), 50.0) / 1000
+
+class Unit:
+    """One ComfoAir unit: its gateway, MQTT base topic and Home Assistant device."""
+
+    def __init__(self, name, host, port, topic, comfosense, pc_mode, first=False):
+        slug = re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+        self.first = first
+        self.id = "ca350" if first else f"ca350_{slug}"
+        self.label = "CA350" if first else f"CA350 {name}"
+        self.host = host
+        self.port = port
+        self.topic = topic or f"{mqtt_base_topic}/{slug}"
+        self.comfosense = comfosense
+        self.pc_mode = pc_mode
+        self.device = {
+            "identifiers": [self.id],
+            "name": self.label,
+            "manufacturer": "Zehnder",
+            "model": "Comfoair 350"
+        }
+
+    def uid(self, key):
+        # the first unit keeps the unique_ids of single-unit installs
+        return key if self.first else f"{self.id}_{key.removeprefix('ca350_')}"
+
+# the top-level options are the first unit, further units each behind their own gateway:
+# units: [{name, comfoair_host, comfoair_port, mqtt_base_topic, comfosense_connected, pc_mode}]
+UNITS = [Unit("CA350", COMFOAIR_HOST, COMFOAIR_PORT, mqtt_base_topic, Comfosense_connected, PcMode, first=True)]
+for entry in options.get('units', []):
+    UNITS.append(Unit(
+        entry['name'],
+        entry['comfoair_host'],
+        int(entry.get('comfoair_port', 8899)),
+        entry.get('mqtt_base_topic'),
+        bool(entry.get('comfosense_connected', Comfosense_connected)),
+        int(entry.get('pc_mode', PcMode)),
+    ))
+for field in ("id", "topic"):
+    seen = [getattr(unit, field) for unit in UNITS]
+    if len(set(seen)) != len(seen):
+        raise ValueError(f"units: duplicate {field} in {seen}")
 # ================== LOGGING ==================
 
 logging.basicConfig(
@@ -57,18 +195,207 @@ for k, v in os.environ.items():
     if "MQTT" in k:
         log.info(f"{k}={v}")
 
+# ================== CONNECTION SUPERVISOR ==================
+
+class Link:
+    """A connection the Supervisor keeps up: MQTT or the CA350 socket of a unit.
+
+    The owner reports up() and down(); open is its connect attempt, which
+    raises on failure (a coroutine function in the asyncio runtime).
+    """
+
+    def __init__(self, name, label, open):
+        self.name = name
+        self.label = label
+        self.open = open
+        self.supervisor = None
+        self.lock = threading.Lock()
+        self.is_up = False
+        self.down_since = None
+        self.pending = False      # attempt armed
+        self.failures = 0         # failed attempts in the current outage
+        self.attempts = 0
+        self.reconnects = 0
+        self.recover_time = Histogram(RECONNECT_BUCKETS)    # this link's own, observed in up()
+
+    def up(self):
+        """Connected; True if this ends an outage."""
+        with self.lock:
+            self.is_up = True
+            down_since, self.down_since = self.down_since, None
+            failures, self.failures = self.failures, 0
+        if down_since is None:
+            return False
+        elapsed = time.monotonic() - down_since
+        self.reconnects += 1
+        self.recover_time.observe(elapsed)
+        log.info(f"{self.label} recovered after {elapsed:.1f} s ({failures} failed attempts)")
+        return True
+
+    def down(self):
+        # from any thread or callback, only arms a timer
+        with self.lock:
+            self.is_up = False
+            if self.down_since is None:
+                self.down_since = time.monotonic()
+        if self.supervisor:
+            self.supervisor.lost(self)
+
+    def outage(self):
+        down_since = self.down_since
+        return time.monotonic() - down_since if down_since is not None else 0.0
+
+    def backoff(self):
+        delay = min(RECONNECT_MAX_DELAY, RECONNECT_MIN_DELAY * 2 ** min(self.failures, 16))
+        return delay * random.uniform(0.5, 1.0)
+
+class Supervisor:
+    """Reconnects lost links with exponential backoff and jitter.
+
+    Nothing blocks in the thread reporting the loss: lost() arms a timer and
+    the attempt runs on the timer's own thread, so a unit timing out does not
+    hold up the broker or other units.
+    """
+
+    def __init__(self):
+        self.links = []
+        self.timers = {}
+        self.stopping = False
+
+    def watch(self, link):
+        link.supervisor = self
+        self.links.append(link)
+
+    def lost(self, link):
+        with link.lock:
+            if link.pending or self.stopping:
+                return
+            link.pending = True
+            delay = link.backoff()
+        log.info(f"Reconnecting to {link.label} in {delay:.1f} s")
+        self.timers[link.name] = self.arm(link, delay)
+
+    def arm(self, link, delay):
+        timer = threading.Timer(delay, self.attempt, (link,))
+        timer.name = f"reconnect-{link.name}"
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def begin(self, link):
+        with link.lock:
+            link.pending = False
+            if self.stopping or link.is_up:
+                return False
+            link.attempts += 1
+        log.info(f"Reconnecting to {link.label}...")
+        return True
+
+    def failed(self, link, e):
+        log.warning(f"{link.label} reconnect failed: {str(e) or type(e).__name__}")
+        link.failures += 1
+        self.lost(link)
+
+    def attempt(self, link):
+        if not self.begin(link):
+            return
+        try:
+            link.open()
+        except Exception as e:
+            self.failed(link, e)
+
+    def stop(self):
+        self.stopping = True
+        for timer in self.timers.values():
+            timer.cancel()
+
 # ================== MQTT MANAGER ==================
 
+def state_topic(base, key, topic_field="state_topic", template_field="value_template"):
+    """Discovery state topic of a status key, its group topic plus template with json_state."""
+    group = KEY_GROUPS.get(key) if JSON_STATE else None
+    if not group:
+        return {topic_field: f"{base}/status/{key}"}
+    return {
+        topic_field: f"{base}/status/{group}",
+        template_field: f"{{{{ value_json.{key} }}}}",
+    }
+
+class Outbox:
+    """Publishes waiting by topic, a newer payload replaces the waiting one.
+
+    Only MQTT_INFLIGHT publishes are handed to paho until it has written
+    them (on_publish), so a slow or lost broker holds the latest value per
+    topic here instead of every value in paho's queue. After a reconnect
+    the current state leaves as one burst.
+    """
+
+    def __init__(self, client, size):
+        self.client = client
+        self.size = size
+        self.pending = collections.OrderedDict()    # topic -> (payload, retain), oldest first
+        self.inflight = set()                       # mids handed to paho
+        self.lock = threading.Lock()
+        self.connected = False
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def put(self, topic, payload, retain):
+        with self.lock:
+            if topic in self.pending:
+                self.coalesced += 1
+            elif len(self.pending) >= self.size:
+                self.pending.popitem(last=False)
+                self.dropped += 1
+            self.pending[topic] = (payload, retain)
+            self.drain()
+
+    def drain(self):
+        # lock held
+        while self.pending and self.connected and len(self.inflight) < MQTT_INFLIGHT:
+            topic, (payload, retain) = self.pending.popitem(last=False)
+            info = self.client.publish(topic, payload, retain=retain)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                # socket already gone, on_disconnect follows
+                self.pending[topic] = (payload, retain)
+                self.pending.move_to_end(topic, last=False)
+                self.connected = False
+                return
+            self.inflight.add(info.mid)
+            self.sent += 1
+
+    def published(self, mid):
+        with self.lock:
+            if mid in self.inflight:
+                self.inflight.discard(mid)
+                self.drain()
+
+    def set_connected(self, connected):
+        with self.lock:
+            # whatever paho had not written is lost with the old socket
+            self.inflight.clear()
+            self.connected = connected
+            self.drain()
+
 class MqttManager:
     def __init__(self):
-        self.ca = None
-        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, "CA350")
+        self.clients = []             # CA350Client per unit, added once created
+        # reconnects are the supervisor's, paho's network thread ends with the connection
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, "CA350", reconnect_on_failure=False)
         self.client.username_pw_set(mqtt_user, mqtt_pass)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
-        self.client.reconnect_delay_set(min_delay=2, max_delay=60)
+        self.client.on_publish = self.on_publish
+        self.outbox = Outbox(self.client, MQTT_OUTBOX_PER_UNIT * len(UNITS))
         self.shutting_down = False
+        self.discovery = None         # [(topic, payload, hash)], built on first connect
+        self.discovery_sent = {}      # topic -> hash of the payload the broker has
+        self.discovery_acks = {}      # mid -> (topic, hash) published with QoS 1, not yet acknowledged
+        self.discovery_skipped = 0
+        self.link = Link("mqtt", "MQTT broker", self.open)
+        self.startup = None           # Startup until the bridge is ready
 
         # Last Will (shows HA if script dies)
         self.client.will_set(
@@ -80,7 +407,16 @@ class MqttManager:
 
     def connect(self):
         log.info("Connecting to MQTT broker...")
-        self.client.connect(mqtt_host, mqtt_port, 60)
+        self.client.connect_async(mqtt_host, mqtt_port, 60)
+        try:
+            self.open()
+        except Exception as e:
+            log.error(f"MQTT connect failed: {e}")
+            self.link.down()
+
+    def open(self):
+        self.client.loop_stop()       # network thread of the lost connection
+        self.client.reconnect()
         self.client.loop_start()
 
     def stop(self):
@@ -94,18 +430,24 @@ class MqttManager:
         except Exception as e:
             log.warning(f"MQTT shutdown error: {e}")
 
-    def publish(self, topic, payload, retain=True):
-        full_topic = f"{mqtt_base_topic}/{topic}"
-        self.client.publish(full_topic, payload, retain=retain)
+    def publish(self, topic, payload, retain=True, base=mqtt_base_topic):
+        self.outbox.put(f"{base}/{topic}", payload, retain)
 
     # ---------- Callbacks ----------
 
     def on_connect(self, client, userdata, flags, reason_code, properties):
         if reason_code == 0:
             log.info("MQTT connected Success")
+            self.outbox.set_connected(True)
+            self.link.up()
+            if self.startup:
+                self.startup.mark("mqtt", "connected")
 
-            # online state
+            # bridge online (the will topic); per unit the state of its gateway link
             self.publish("status", "online", retain=True)
+            down = {ca.unit.id for ca in self.clients if not ca.link.is_up}
+            for unit in UNITS:
+                self.publish("availability", "offline" if unit.id in down else "online", retain=True, base=unit.topic)
 
             # subscribe to command topics
             self.subscribe_commands()
@@ -113,45 +455,59 @@ class MqttManager:
             # Home Assistant discovery
             self.publish_discovery()
 
+            # broker may have lost retained values
+            for ca in self.clients:
+                ca.republish_state()
+
         else:
             log.error(f"MQTT connect failed: {reason_code}")
 
     def on_disconnect(self, client, userdata, flags, reason_code, properties):
         log.warning(f"MQTT disconnected: {reason_code}")
-        if self.shutting_down:
-            return
-
-        while not self.shutting_down:
-            try:
-                log.info("Trying MQTT reconnect...")
-                client.reconnect()
-                break
-            except Exception:
-                time.sleep(5)
+        self.outbox.set_connected(False)
+        # unacknowledged configs are sent again on the next connect
+        self.discovery_acks.clear()
+        if not self.shutting_down:
+            self.link.down()
+
+    def on_publish(self, client, userdata, mid, reason_code, properties):
+        self.outbox.published(mid)
+        acked = self.discovery_acks.pop(mid, None)
+        if acked:
+            topic, digest = acked
+            self.discovery_sent[topic] = digest
 
     def on_message(self, client, userdata, msg):
-        if not self.ca:
+        if msg.topic == f"{ha_prefix}/status":
+            # HA birth message: HA restarted and needs the configs again
+            if msg.payload == b"online" and not msg.retain:
+                log.info("Home Assistant online, republishing discovery")
+                self.publish_discovery(force=True)
             return
 
-        topic = msg.topic.replace(f"{mqtt_base_topic}/set/", "")
+        ca, topic = self.route(msg.topic)
+        if not ca:
+            return
         payload = msg.payload.decode().strip()
 
-        log.info(f"MQTT CMD {topic} = {payload}")
+        log.info(f"MQTT CMD {topic} = {payload}" if ca.unit.first else f"MQTT CMD {ca.unit.label} {topic} = {payload}")
 
+        message = MessageTrace(topic, msg.timestamp)
+        token = current_message.set(message)
         try:
             # --- Climate entity topics ---
             if topic == "climate/mode":
                 # HA sends: off / fan_only
                 if payload == "off":
-                    if  self.ca.current_booster == True:
-                        	self.ca.cancel_booster()
-                    self.ca.set_fan_level(1)  # off = minimal
+                    if  ca.state.booster == True:
+                        	ca.cancel_booster()
+                    ca.set_fan_level(1)  # off = minimal
                 else:
                     # fan_only -> keep current, but ensure at least 2 if None
-                    if self.ca.current_fan_level is None:
-                        self.ca.set_fan_level(2)
+                    if ca.state.fan_level is None:
+                        ca.set_fan_level(2)
                     if payload == "fan_only":
-                        self.ca.set_fan_level(2)
+                        ca.set_fan_level(2)
 
             elif topic == "climate/fan_mode":
                 MAP = {
@@ -160,81 +516,125 @@ class MqttManager:
                     "high": 4,
                     "off": 1,
                 }
-                self.ca.set_fan_level(MAP.get(payload, 2))
+                ca.set_fan_level(MAP.get(payload, 2))
 
             elif topic == "climate/preset_mode":
                 if payload == "boost":
-                    self.ca.set_booster()
+                    ca.set_booster()
                 else:
-                    self.ca.cancel_booster()
+                    ca.cancel_booster()
             elif topic == "booster_switch":
                 if payload == "ON":
-                    self.ca.set_booster()
+                    ca.set_booster()
                 else:
-                    self.ca.cancel_booster()
+                    ca.cancel_booster()
             elif topic == "climate/temperature":
-                self.ca.set_temperature(float(payload))
+                ca.set_temperature(float(payload))
 
             elif topic == "pc_mode":
-                self.ca.set_pc_mode(int(payload))
+                ca.set_pc_mode(int(payload))
                 
             elif topic == "airflow_mode":
                 mode = payload
-                self.ca.set_airflow_mode(mode)
+                ca.set_airflow_mode(mode)
                 
             elif topic == "filter_reset":
-                self.ca.reset_filter()
+                ca.reset_filter()
+            elif topic == "dump_frames":
+                ca.dump_frames("MQTT request")
             elif topic == "booster_time":
-                self.ca.set_booster_time(int(payload))
+                ca.set_booster_time(int(payload))
             elif topic == "ventilation_mode":
                 mode = payload.strip().lower() 
-                self.ca.set_auto_mode(mode)                                
+                ca.set_auto_mode(mode)                                
             elif topic == "filter_time":
                 try:
                     weeks = int(payload)
-                    self.ca.set_filter_time(weeks)
+                    ca.set_filter_time(weeks)
                 except:
                     log.warning(f"Invalid filter time: {payload}")
                     
         except Exception as e:
             log.warning(f"MQTT command error: {e}")
+        finally:
+            message.dispatched = time.monotonic()
+            current_message.reset(token)
+
+    def route(self, topic):
+        # client of the unit a command topic belongs to and the command below set/
+        for ca in self.clients:
+            prefix = f"{ca.unit.topic}/set/"
+            if topic.startswith(prefix):
+                return ca, topic[len(prefix):]
+        return None, None
 
     def subscribe_commands(self):
-        self.client.subscribe(f"{mqtt_base_topic}/set/#")
+        for unit in UNITS:
+            self.client.subscribe(f"{unit.topic}/set/#")
+        self.client.subscribe(f"{ha_prefix}/status")
         log.info("Subscribed to MQTT command topics")
 
     # ---------- HOME ASSISTANT DISCOVERY ----------
 
-    def publish_discovery(self):
+    def publish_discovery(self, force=False):
+        # configs are retained and depend on the options only, so within one run the
+        # digests only spare the republish on an MQTT reconnect (the first connect and
+        # the HA birth message send all); QoS 1 so a config counts as sent once the
+        # broker acknowledged it (on_publish)
+        if self.discovery is None:
+            self.discovery = [
+                (topic, payload, hashlib.sha1(payload.encode()).hexdigest())
+                for unit in UNITS
+                for topic, payload in self.build_discovery(unit)
+            ]
+        sent = skipped = 0
+        for topic, payload, digest in self.discovery:
+            if not force and self.discovery_sent.get(topic) == digest:
+                skipped += 1
+                continue
+            info = self.client.publish(topic, payload, qos=1, retain=True)
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                self.discovery_acks[info.mid] = (topic, digest)
+            sent += 1
+        self.discovery_skipped += skipped
+        log.info(
+            f"Discovery: {sent} configs published, {skipped} already on the broker "
+            f"({self.discovery_skipped} skipped on reconnects since start)"
+        )
+
+    def build_discovery(self, unit):
+        # (config topic, payload) of every entity of a unit, depends on the options only
+        configs = []
+        base = unit.topic
 
+        # offline with the bridge (will) or with the unit's gateway link alone
         availability = {
-            "availability_topic": f"{mqtt_base_topic}/status",
-            "payload_available": "online",
-            "payload_not_available": "offline",
+            "availability": [{"topic": f"{mqtt_base_topic}/status"}, {"topic": f"{base}/availability"}],
+            "availability_mode": "all",
         }
 
         # --------- CLIMATE ENTITY ---------
 
         climate_cfg = {
-            "name": "CA350",
-            "unique_id": "ca350_climate",
-            "device": DEVICE_INFO,
+            "name": unit.label,
+            "unique_id": unit.uid("ca350_climate"),
+            "device": unit.device,
 
-            "mode_state_topic": f"{mqtt_base_topic}/status/hvac_mode",
-            "mode_command_topic": f"{mqtt_base_topic}/set/climate/mode",
+            **state_topic(base, "hvac_mode", "mode_state_topic", "mode_state_template"),
+            "mode_command_topic": f"{base}/set/climate/mode",
             "modes": ["off", "fan_only"],
             
-            "preset_mode_state_topic": f"{mqtt_base_topic}/status/preset_mode",
-            "preset_mode_command_topic": f"{mqtt_base_topic}/set/climate/preset_mode",
+            **state_topic(base, "preset_mode", "preset_mode_state_topic", "preset_mode_value_template"),
+            "preset_mode_command_topic": f"{base}/set/climate/preset_mode",
             "preset_modes": ["boost"],
 
-            "fan_mode_state_topic": f"{mqtt_base_topic}/status/fan_mode",
-            "fan_mode_command_topic": f"{mqtt_base_topic}/set/climate/fan_mode",
+            **state_topic(base, "fan_mode", "fan_mode_state_topic", "fan_mode_state_template"),
+            "fan_mode_command_topic": f"{base}/set/climate/fan_mode",
             "fan_modes": ["off", "low", "medium", "high"],
 
-            "temperature_state_topic": f"{mqtt_base_topic}/status/comfort_temp",
-            "current_temperature_topic": f"{mqtt_base_topic}/status/extract_temp",
-            "temperature_command_topic": f"{mqtt_base_topic}/set/climate/temperature",
+            **state_topic(base, "comfort_temp", "temperature_state_topic", "temperature_state_template"),
+            **state_topic(base, "extract_temp", "current_temperature_topic", "current_temperature_template"),
+            "temperature_command_topic": f"{base}/set/climate/temperature",
             "min_temp": 15,
             "max_temp": 27,
             "temp_step": 0.5,
@@ -243,112 +643,95 @@ class MqttManager:
         }
         
         air_cfg = {
-            "name": "CA350 Airflow Mode",
-            "unique_id": "ca350_airflow_mode",
-            "state_topic": f"{mqtt_base_topic}/status/airflow_mode",
-            "command_topic": f"{mqtt_base_topic}/set/airflow_mode",
+            "name": f"{unit.label} Airflow Mode",
+            "unique_id": unit.uid("ca350_airflow_mode"),
+            **state_topic(base, "airflow_mode"),
+            "command_topic": f"{base}/set/airflow_mode",
             "options": ["In", "Out", "In and Out"],
-            "device": DEVICE_INFO,
+            "device": unit.device,
             **availability,
         }
         button_cfg = {
-            "name": "CA350 Filter Reset",
-            "unique_id": "ca350_filter_reset",
-            "command_topic": f"{mqtt_base_topic}/set/filter_reset",
-            "device": DEVICE_INFO,
+            "name": f"{unit.label} Filter Reset",
+            "unique_id": unit.uid("ca350_filter_reset"),
+            "command_topic": f"{base}/set/filter_reset",
+            "device": unit.device,
             **availability,
         }
                 
+        dump_cfg = {
+            "name": f"{unit.label} Dump frame log",
+            "unique_id": unit.uid("ca350_dump_frames"),
+            "command_topic": f"{base}/set/dump_frames",
+            "entity_category": "diagnostic",
+            "icon": "mdi:file-download-outline",
+            "device": unit.device,
+            **availability,
+        }
+
         booster_cfg = {
-            "name": "CA350 Booster Time",
-            "unique_id": "ca350_booster_time",
-            "state_topic": f"{mqtt_base_topic}/status/booster_time",
-            "command_topic": f"{mqtt_base_topic}/set/booster_time",
+            "name": f"{unit.label} Booster Time",
+            "unique_id": unit.uid("ca350_booster_time"),
+            **state_topic(base, "booster_time"),
+            "command_topic": f"{base}/set/booster_time",
             "min": 0,
             "max": 120,
             "step": 1,
             "unit_of_measurement": "min",
             "icon": "mdi:timer-outline",
-            "device": DEVICE_INFO,
+            "device": unit.device,
             **availability
         }
         booster_switch_cfg = {
-            "name": "CA350 Booster",
-            "unique_id": "ca350_booster_switch",
-            "state_topic": f"{mqtt_base_topic}/status/booster_active_bin",
-            "command_topic": f"{mqtt_base_topic}/set/booster_switch",
+            "name": f"{unit.label} Booster",
+            "unique_id": unit.uid("ca350_booster_switch"),
+            **state_topic(base, "booster_active_bin"),
+            "command_topic": f"{base}/set/booster_switch",
             "payload_on": "ON",
             "payload_off": "OFF",
             "state_on": "ON",
             "state_off": "OFF",
             "icon": "mdi:fan-clock",
-            "device": DEVICE_INFO,
+            "device": unit.device,
             **availability
         }
         
         mode_select_cfg = {
-            "name": "CA350 Mode",
-            "unique_id": "ca350_mode_select",
-            "state_topic": f"{mqtt_base_topic}/status/ventilation_mode",
-            "command_topic": f"{mqtt_base_topic}/set/ventilation_mode",
+            "name": f"{unit.label} Mode",
+            "unique_id": unit.uid("ca350_mode_select"),
+            **state_topic(base, "ventilation_mode"),
+            "command_topic": f"{base}/set/ventilation_mode",
             "options": ["AUTO", "MANUAL"],
             "icon": "mdi:calendar-clock",
-            "device": DEVICE_INFO,
+            "device": unit.device,
             **availability
         }
         filter_cfg = {
-            "name": "CA350 Filter time",
-            "unique_id": "filter_time_set",
-            "state_topic": f"{mqtt_base_topic}/status/filter_time",
-            "command_topic": f"{mqtt_base_topic}/set/filter_time",
+            "name": f"{unit.label} Filter time",
+            "unique_id": unit.uid("filter_time_set"),
+            **state_topic(base, "filter_time"),
+            "command_topic": f"{base}/set/filter_time",
             "min": 10,
             "max": 26,
             "step": 1,
             "unit_of_measurement": "wk",
             "icon": "mdi:air-filter",
             "mode": "slider",
-            "device": DEVICE_INFO,
+            "device": unit.device,
             **availability
         }
-        self.client.publish(
-            f"{ha_prefix}/button/ca350/filter_reset/config",
-            json.dumps(button_cfg),
-            retain=True
-        )
-        self.client.publish(
-            f"{ha_prefix}/select/ca350/airflow_mode/config",
-            json.dumps(air_cfg),
-            retain=True
-        )
+        configs.append((f"{ha_prefix}/button/{unit.id}/filter_reset/config", json.dumps(button_cfg)))
+        configs.append((f"{ha_prefix}/button/{unit.id}/dump_frames/config", json.dumps(dump_cfg)))
+        configs.append((f"{ha_prefix}/select/{unit.id}/airflow_mode/config", json.dumps(air_cfg)))
 
-        self.client.publish(
-            f"{ha_prefix}/climate/ca350/main/config",
-            json.dumps(climate_cfg),
-            retain=True
-        )
+        configs.append((f"{ha_prefix}/climate/{unit.id}/main/config", json.dumps(climate_cfg)))
         
-        self.client.publish(
-            f"{ha_prefix}/number/ca350/booster_time/config",
-            json.dumps(booster_cfg),
-            retain=True
-        )
-        self.client.publish(
-            f"{ha_prefix}/switch/ca350/booster/config",
-            json.dumps(booster_switch_cfg),
-            retain=True
-        )
+        configs.append((f"{ha_prefix}/number/{unit.id}/booster_time/config", json.dumps(booster_cfg)))
+        configs.append((f"{ha_prefix}/switch/{unit.id}/booster/config", json.dumps(booster_switch_cfg)))
         
-        self.client.publish(
-            f"{ha_prefix}/select/ca350/mode/config",
-            json.dumps(mode_select_cfg),
-            retain=True
-        )
+        configs.append((f"{ha_prefix}/select/{unit.id}/mode/config", json.dumps(mode_select_cfg)))
         
-        self.client.publish(
-            f"{ha_prefix}/number/ca350/filter_time/config",
-            json.dumps(filter_cfg),
-            retain=True
-        )
+        configs.append((f"{ha_prefix}/number/{unit.id}/filter_time/config", json.dumps(filter_cfg)))
 
         # --------- SENSORS ---------
 
@@ -374,31 +757,27 @@ class MqttManager:
             ("hours_filter", "Operating hours filter", "h", "mdi:air-filter"),
         ]
 
-        for key, name, unit, icon in sensors:
+        for key, name, uom, icon in sensors:
             cfg = {
-                "name": f"CA350 {name}",
-                "unique_id": f"{key}",
-                "state_topic": f"{mqtt_base_topic}/status/{key}",
+                "name": f"{unit.label} {name}",
+                "unique_id": unit.uid(key),
+                **state_topic(base, key),
                 "icon": icon,
-                "device": DEVICE_INFO,
+                "device": unit.device,
                 **availability
             }
-            if unit:
-                cfg["unit_of_measurement"] = unit
-            if unit == "°C":
+            if uom:
+                cfg["unit_of_measurement"] = uom
+            if uom == "°C":
                 cfg["device_class"] = "temperature"
                 cfg["state_class"] = "measurement"
-            if unit == "%":
+            if uom == "%":
                 cfg["state_class"] = "measurement"
-            if unit == "h":
+            if uom == "h":
                 cfg["device_class"] = "duration"
                 cfg["state_class"] = "total_increasing"
 
-            self.client.publish(
-                f"{ha_prefix}/sensor/ca350/{key}/config",
-                json.dumps(cfg),
-                retain=True
-            )
+            configs.append((f"{ha_prefix}/sensor/{unit.id}/{key}/config", json.dumps(cfg)))
         # ---------- Binary Sensors ----------
 
         binary_sensors = [
@@ -412,54 +791,913 @@ class MqttManager:
         
         for key, name, icon in binary_sensors:
             cfg = {
-                "name": f"CA350 {name}",
-                "unique_id": f"{key}",
-                "state_topic": f"{mqtt_base_topic}/status/{key}",
+                "name": f"{unit.label} {name}",
+                "unique_id": unit.uid(key),
+                **state_topic(base, key),
                 "payload_on": "ON",
                 "payload_off": "OFF",
                 "icon": icon,
-                "device": DEVICE_INFO,
+                "device": unit.device,
                 **availability,
             }
         
-            self.client.publish(
-                f"{ha_prefix}/binary_sensor/ca350/{key}/config",
-                json.dumps(cfg),
-                retain=True,
+            configs.append((f"{ha_prefix}/binary_sensor/{unit.id}/{key}/config", json.dumps(cfg)))
+
+        return configs
+
+class UnitMqtt:
+    """A unit's view of the shared MQTT connection, topics below the unit's base topic."""
+
+    def __init__(self, manager, unit):
+        self.manager = manager
+        self.unit = unit
+
+    def publish(self, topic, payload, retain=True):
+        self.manager.publish(topic, payload, retain, self.unit.topic)
+
+# ================== DEVICE STATE ==================
+
+class DeviceState:
+    """Last decoded values of the unit and the payloads last sent for them."""
+
+    __slots__ = (
+        "fan_level", "comfo_temp_c", "comfo_temp_raw", "rs232_mode",
+        "airflow_mode", "booster", "filter_warn", "booster_time",
+        "filter_time", "delay_values", "auto_mode", "manual_mode",
+        "published", "publish_count", "suppressed_count",
+    )
+
+    def __init__(self):
+        self.fan_level = None
+        self.comfo_temp_c = None
+        self.comfo_temp_raw = None
+        self.rs232_mode = None
+        self.airflow_mode = None
+        self.booster = False
+        self.filter_warn = False
+        self.booster_time = None
+        self.filter_time = None
+        self.delay_values = None
+        self.auto_mode = None
+        self.manual_mode = None
+
+        self.published = {}     # status key -> last published payload
+        self.publish_count = 0
+        self.suppressed_count = 0
+
+    def changed(self, key, payload, force=False):
+        """Remember payload for key, False if it equals the last published one."""
+        if not force and PUBLISH_HEARTBEAT and self.published.get(key) == payload:
+            self.suppressed_count += 1
+            return False
+        self.published[key] = payload
+        self.publish_count += 1
+        return True
+
+# ================== STATE SNAPSHOT ==================
+
+class StateSnapshot:
+    """Last data of the frames a unit only sends on request, kept across restarts.
+
+    Stored as hex per command and decoded like received frames when loaded.
+    The scheduler job only serializes it; a writer thread writes a temp file
+    and renames it, so a crash leaves the old or the new snapshot, never half
+    a file.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = {}          # cmd -> data
+        self.dirty = False
+        self.pending = False      # save scheduled
+        self.saved_at = -STATE_SAVE_INTERVAL
+        self.writes = 0
+        self.queue = queue.Queue(2)
+        self.lock = threading.Lock()
+        self.writer = None
+
+    def load(self):
+        """(cmd, data) of the saved frames, nothing if missing or unreadable."""
+        try:
+            with open(self.path) as f:
+                snap = json.load(f)
+            if snap.get("version") != self.VERSION:
+                return []
+            frames = {bytes.fromhex(cmd): bytes.fromhex(data) for cmd, data in snap["frames"].items()}
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            log.warning(f"State snapshot {self.path} ignored: {e}")
+            return []
+        age = time.time() - snap.get("saved", 0)
+        log.info(f"State snapshot loaded from {self.path} ({len(frames)} frames, {age / 3600:.1f} h old)")
+        self.frames = frames
+        return list(frames.items())
+
+    def update(self, cmd, data):
+        """Remember a frame, True if it differs from the one kept."""
+        if self.frames.get(cmd) == data:
+            return False
+        self.frames[cmd] = bytes(data)
+        self.dirty = True
+        return True
+
+    def save_delay(self):
+        return max(self.saved_at + STATE_SAVE_INTERVAL - time.monotonic(), 0)
+
+    def save(self):
+        self.pending = False
+        if not self.dirty:
+            return
+        self.dirty = False
+        self.saved_at = time.monotonic()
+        snap = {
+            "version": self.VERSION,
+            "saved": round(time.time()),
+            "frames": {cmd.hex(): data.hex() for cmd, data in list(self.frames.items())},
+        }
+        try:
+            self.queue.put_nowait(json.dumps(snap, separators=(",", ":")))
+        except queue.Full:
+            self.dirty = True       # writer stuck, the next save or stop tries again
+            return
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.run, name="snapshot-writer", daemon=True)
+                self.writer.start()
+
+    def run(self):
+        while True:
+            items = [self.queue.get()]
+            while not self.queue.empty():
+                items.append(self.queue.get_nowait())
+            texts = [text for text in items if text is not None]
+            if texts:
+                self.write(texts[-1])       # only the newest matters
+            if None in items:
+                return
+
+    def write(self, text):
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self.writes += 1
+        except OSError as e:
+            log.warning(f"State snapshot not saved: {e}")
+
+    def close(self):
+        # at stop: save what changed and wait for the writer
+        self.save()
+        with self.lock:
+            writer, self.writer = self.writer, None
+        if writer:
+            self.queue.put(None)
+            writer.join(2)
+
+def make_snapshot(unit):
+    if not STATE_SNAPSHOT:
+        return None
+    return StateSnapshot(os.path.join(DATA_DIR, f"{unit.id}_state.json"))
+
+# ================== RX CAPTURE ==================
+
+class FrameCapture:
+    """Raw received chunks with monotonic timestamps, rotated over CAPTURE_FILES files.
+
+    File layout: MAGIC, then per chunk RECORD (timestamp, length) and the
+    bytes. A record of length 0 marks a (re)connect. The RX path only
+    queues a copy of the chunk; a writer thread does the file I/O and the
+    rotation. Chunks beyond a full queue are dropped and counted.
+    """
+
+    MAGIC = b"CA350CAP\x01"
+    RECORD = struct.Struct("<dH")
+    FLUSH_INTERVAL = 5
+
+    def __init__(self, path, max_bytes, files=CAPTURE_FILES):
+        self.path = path
+        self.files = files
+        self.file_bytes = max(int(max_bytes / files), 4096)
+        self.queue = queue.Queue(CAPTURE_QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.writer = None
+        self.closed = False
+        self.dropped = 0
+        self.f = None
+        self.size = 0
+        # the capture of the previous run may hold the incident behind the restart
+        if os.path.exists(path) and os.path.getsize(path) > len(self.MAGIC):
+            self.shift()
+        self.open()
+
+    def open(self):
+        self.f = open(self.path, "wb")
+        self.f.write(self.MAGIC)
+        self.size = len(self.MAGIC)
+
+    def shift(self):
+        # capture.bin -> capture.bin.1 -> ... -> capture.bin.<files-1>
+        for n in range(self.files - 1, 0, -1):
+            src = self.path if n == 1 else f"{self.path}.{n - 1}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{n}")
+
+    def rotate(self):
+        self.f.close()
+        self.shift()
+        self.open()
+
+    def write(self, data):
+        # rx thread or event loop: data may be a view into rx_buf, keep a copy
+        try:
+            self.queue.put_nowait((time.monotonic(), bytes(data)))
+        except queue.Full:
+            self.dropped += 1
+            return
+        with self.lock:
+            if self.writer is None and not self.closed:
+                self.writer = threading.Thread(target=self.run, name="ca350-capture", daemon=True)
+                self.writer.start()
+
+    def mark(self):
+        self.write(b"")
+
+    def run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.FLUSH_INTERVAL)
+            except queue.Empty:
+                self.flush()
+                continue
+            if item is None:
+                return
+            try:
+                self.append(*item)
+            except (OSError, ValueError) as e:
+                log.error(f"RX capture stopped: {e}")
+                return
+
+    def append(self, now, data):
+        if self.size + self.RECORD.size + len(data) > self.file_bytes:
+            self.rotate()
+        self.f.write(self.RECORD.pack(now, len(data)))
+        self.f.write(data)
+        self.size += self.RECORD.size + len(data)
+
+    def flush(self):
+        try:
+            self.f.flush()
+        except OSError:
+            pass
+
+    def close(self):
+        # writes what is queued, then closes the file
+        with self.lock:
+            writer, self.writer = self.writer, None
+            self.closed = True
+        if writer:
+            self.queue.put(None)
+            writer.join(2)
+        self.f.close()
+
+def make_capture(unit):
+    if not CAPTURE:
+        return None
+    path = os.path.join(DATA_DIR, f"{unit.id}_capture.bin")
+    try:
+        capture = FrameCapture(path, CAPTURE_SIZE_MB * 1024 * 1024)
+    except OSError as e:
+        log.error(f"RX capture disabled: {e}")
+        return None
+    log.info(f"Capturing RX bytes to {path} ({CAPTURE_SIZE_MB:g} MB max)")
+    return capture
+
+# ================== FRAME LOG ==================
+
+FRAME_OK = 0
+FRAME_CHECKSUM = 1
+FRAME_RESYNC = 2
+FRAME_RESULTS = ("ok", "checksum error", "resync")
+
+class FrameLog:
+    """Ring buffer of the last raw frames, only formatted when dumped."""
+
+    def __init__(self, size, prefix="ca350"):
+        self.size = size
+        self.prefix = prefix        # dump file names, one set per unit
+        self.times = [0.0] * size
+        self.results = bytearray(size)
+        self.frames = [b""] * size
+        self.pos = 0
+        self.count = 0
+        self.burst_start = 0.0
+        self.burst_errors = 0
+        self.last_auto_dump = -FRAME_LOG_DUMP_INTERVAL
+
+    def add(self, raw, result=FRAME_OK):
+        i = self.pos
+        self.times[i] = time.monotonic()
+        self.results[i] = result
+        self.frames[i] = bytes(raw)
+        self.pos = (i + 1) % self.size
+        self.count += 1
+
+    def checksum_error(self):
+        now = time.monotonic()
+        if now - self.burst_start > FRAME_LOG_BURST_WINDOW:
+            self.burst_start = now
+            self.burst_errors = 0
+        self.burst_errors += 1
+        if self.burst_errors == FRAME_LOG_BURST:
+            self.dump("checksum error burst", auto=True)
+
+    def snapshot(self):
+        # oldest first; taken in the caller's thread, formatting happens later
+        n = min(self.count, self.size)
+        start = (self.pos - n) % self.size
+        order = [(start + k) % self.size for k in range(n)]
+        return [(self.times[i], self.results[i], self.frames[i]) for i in order]
+
+    def dump(self, reason, auto=False):
+        now = time.monotonic()
+        if auto:
+            if now - self.last_auto_dump < FRAME_LOG_DUMP_INTERVAL:
+                return
+            self.last_auto_dump = now
+        entries = self.snapshot()
+        threading.Thread(target=self.write, args=(reason, entries), daemon=True).start()
+
+    def write(self, reason, entries):
+        path = os.path.join(DATA_DIR, f"{self.prefix}_frames_{time.strftime('%Y%m%d_%H%M%S')}.txt")
+        offset = time.time() - time.monotonic()
+        try:
+            with open(path, "w") as f:
+                f.write(f"# {reason}, last {len(entries)} of {self.count} frames\n")
+                for t, result, raw in entries:
+                    wall = t + offset
+                    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(wall))
+                    f.write(f"{stamp}.{int(wall % 1 * 1000):03d}  {FRAME_RESULTS[result]:<15} {raw.hex(' ')}\n")
+            for old in sorted(glob.glob(os.path.join(DATA_DIR, f"{self.prefix}_frames_*.txt")))[:-FRAME_LOG_KEEP]:
+                os.remove(old)
+        except OSError as e:
+            log.error(f"Frame log dump failed: {e}")
+            return
+        log.info(f"Frame log dumped to {path} ({reason})")
+
+# ================== METRICS ==================
+
+# seconds, from bytes received to the last publish of the frame
+RX_LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+# seconds a link was down before it came back
+RECONNECT_BUCKETS = (1, 2, 5, 10, 30, 60, 300, 900)
+# seconds a command waited in the queue behind others
+QUEUE_WAIT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Histogram:
+    """Bucket counts for the metrics endpoint.
+
+    Every histogram has one writer at a time, so no lock: a unit's RX
+    thread, its command worker, the connect attempt of one link (the
+    initial connect, then the supervisor's, never two at once) or the
+    event loop. A scrape may see a value counted in one field and not yet
+    in another.
+    """
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def lines(self, name, labels=""):
+        sep = "," if labels else ""
+        total = 0
+        for bound, n in zip(self.bounds, self.counts):
+            total += n
+            yield f'{name}_bucket{{{labels}{sep}le="{bound}"}} {total}'
+        yield f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}'
+        yield f"{name}_count{{{labels}}} {self.count}" if labels else f"{name}_count {self.count}"
+        yield f"{name}_sum{{{labels}}} {self.sum}" if labels else f"{name}_sum {self.sum}"
+
+def render_metrics(mqtt_mgr):
+    """All statistics in OpenMetrics text format, per unit with a unit label."""
+    clients = mqtt_mgr.clients
+    out = []
+
+    def metric(name, kind, help_text, samples):
+        out.append(f"# TYPE {name} {kind}")
+        out.append(f"# HELP {name} {help_text}")
+        suffix = "_total" if kind == "counter" else ""
+        for labels, value in samples:
+            out.append(f"{name}{suffix}{{{labels}}} {value}" if labels else f"{name}{suffix} {value}")
+
+    def per_unit(name, kind, help_text, value):
+        metric(name, kind, help_text, [(f'unit="{ca.unit.id}"', value(ca)) for ca in clients])
+
+    metric("ca350_rx_frames", "counter", "Frames received by command", [
+        (f'unit="{ca.unit.id}",cmd="{cmd.hex()}"', n)
+        for ca in clients for cmd, n in sorted(ca.rx_frames.items())
+    ])
+    per_unit("ca350_rx_bytes", "counter", "Bytes received from the gateway", lambda ca: ca.rx_bytes)
+    per_unit("ca350_checksum_errors", "counter", "Frames with a bad checksum", lambda ca: ca.checksum_errors)
+    per_unit("ca350_rx_resyncs", "counter", "Parser resyncs after broken frames", lambda ca: ca.rx_resyncs)
+    per_unit("ca350_rx_dropped_bytes", "counter", "Bytes skipped by the parser", lambda ca: ca.rx_dropped)
+    per_unit("ca350_publishes", "counter", "Status values published", lambda ca: ca.state.publish_count)
+    per_unit("ca350_publishes_suppressed", "counter", "Unchanged status values not published",
+             lambda ca: ca.state.suppressed_count)
+    per_unit("ca350_tx_frames", "counter", "Frames sent to the gateway", lambda ca: ca.tx.frames)
+    per_unit("ca350_tx_segments", "counter", "Writes to the gateway socket", lambda ca: ca.tx.segments)
+    per_unit("ca350_tx_segments_saved", "counter", "Frames sent together with others", lambda ca: ca.tx.saved())
+    per_unit("ca350_link_stalls", "counter", "Reconnects because nothing was received", lambda ca: ca.link_stalls)
+    if CAPTURE:
+        per_unit("ca350_capture_dropped", "counter", "RX chunks not captured on a full queue",
+                 lambda ca: ca.capture.dropped if ca.capture else 0)
+    per_unit("ca350_state_snapshot_writes", "counter", "State snapshots written",
+             lambda ca: ca.snapshot.writes if ca.snapshot else 0)
+    per_unit("ca350_commands_rejected", "counter", "Commands dropped on a full queue", lambda ca: ca.executor.rejected)
+    per_unit("ca350_command_queue_depth", "gauge", "Commands waiting", lambda ca: ca.executor.depth())
+    per_unit("ca350_command_queue_max_depth", "gauge", "Most commands waiting at once since start",
+             lambda ca: ca.executor.max_depth)
+    scheduler = clients[0].scheduler if clients else None
+    if scheduler:
+        metric("ca350_scheduler_wakeups", "counter", "Scheduler sleeps ended", [("", scheduler.wakeups)])
+    if TRACE_SPANS:
+        metric("ca350_trace_spans_dropped", "counter", "Span lines dropped on a full trace writer queue",
+               [("", TRACE_FILE.dropped)])
+    links = [
+        *((f'link="ca350",unit="{ca.unit.id}"', ca.link) for ca in clients),
+        ('link="mqtt"', mqtt_mgr.link),
+    ]
+    metric("ca350_link_up", "gauge", "Connection state", [(labels, int(link.is_up)) for labels, link in links])
+    metric("ca350_link_down_seconds", "gauge", "Length of the current outage",
+           [(labels, round(link.outage(), 3)) for labels, link in links])
+    outbox = mqtt_mgr.outbox
+    metric("ca350_mqtt_outbox_depth", "gauge", "Topics waiting in the MQTT outbox", [("", len(outbox.pending))])
+    metric("ca350_mqtt_inflight", "gauge", "Publishes handed to paho, not yet written", [("", len(outbox.inflight))])
+    metric("ca350_mqtt_published", "counter", "Publishes sent from the outbox", [("", outbox.sent)])
+    metric("ca350_mqtt_coalesced", "counter", "Waiting values replaced by a newer one", [("", outbox.coalesced)])
+    metric("ca350_mqtt_dropped", "counter", "Topics dropped on a full outbox", [("", outbox.dropped)])
+    metric("ca350_reconnects", "counter", "Reconnects after a lost connection",
+           [(labels, link.reconnects) for labels, link in links])
+    metric("ca350_reconnect_attempts", "counter", "Connect attempts by the supervisor",
+           [(labels, link.attempts) for labels, link in links])
+    out.append("# TYPE ca350_reconnect_duration_seconds histogram")
+    out.append("# HELP ca350_reconnect_duration_seconds Connection lost to connection back (time to recover)")
+    for labels, link in links:
+        out.extend(link.recover_time.lines("ca350_reconnect_duration_seconds", labels))
+    out.append("# TYPE ca350_command_verify_seconds summary")
+    out.append("# HELP ca350_command_verify_seconds First frame written to the confirming frame decoded")
+    verify = [
+        (f'unit="{ca.unit.id}",command="{kind}"', stats)
+        for ca in clients for kind, stats in sorted(list(ca.verify_latency.items()))
+    ]
+    for labels, (count, total, _) in verify:
+        out.append(f"ca350_command_verify_seconds_count{{{labels}}} {count}")
+        out.append(f"ca350_command_verify_seconds_sum{{{labels}}} {round(total, 6)}")
+    metric("ca350_command_verify_max_seconds", "gauge", "Slowest confirmation per command",
+           [(labels, round(worst, 6)) for labels, (_, _, worst) in verify])
+    out.append("# TYPE ca350_rx_publish_latency_seconds histogram")
+    out.append("# HELP ca350_rx_publish_latency_seconds Bytes received to frame published")
+    for ca in clients:
+        out.extend(ca.rx_latency.lines("ca350_rx_publish_latency_seconds", f'unit="{ca.unit.id}"'))
+    out.append("# TYPE ca350_command_queue_wait_seconds histogram")
+    out.append("# HELP ca350_command_queue_wait_seconds Command queued to command started")
+    for ca in clients:
+        out.extend(ca.executor.wait_time.lines("ca350_command_queue_wait_seconds", f'unit="{ca.unit.id}"'))
+    out.append("# TYPE ca350_command_duration_seconds histogram")
+    out.append("# HELP ca350_command_duration_seconds MQTT receipt (or queueing) to command done")
+    for ca in clients:
+        for name, stats in sorted(ca.tracer.stats.items()):
+            out.extend(stats[0].lines("ca350_command_duration_seconds", f'unit="{ca.unit.id}",command="{name}"'))
+    out.append("# EOF")
+    return "\n".join(out) + "\n"
+
+METRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render_metrics(self.server.mqtt_mgr).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", METRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(mqtt_mgr):
+    # threads runtime: scrapes are answered on their own thread
+    try:
+        server = http.server.ThreadingHTTPServer(("", METRICS_PORT), MetricsHandler)
+    except OSError as e:
+        log.error(f"Metrics endpoint disabled: {e}")
+        return None
+    server.daemon_threads = True
+    server.mqtt_mgr = mqtt_mgr
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log.info(f"Metrics on http://0.0.0.0:{METRICS_PORT}/metrics")
+    return server
+
+# ================== COMMAND TRACING ==================
+
+# seconds from MQTT receipt (or queueing) to command completion
+COMMAND_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+
+# stage -> (start, end) timestamps of CommandTrace / MessageTrace
+TRACE_STAGES = {
+    "mqtt": ("received", "dispatched"),
+    "queue": ("queued", "started"),
+    "send": ("started", "sent"),
+    "verify": ("sent", "confirmed"),
+}
+
+# set by on_message while it dispatches, picked up by the commands it queues
+current_message = contextvars.ContextVar("current_message", default=None)
+
+class MessageTrace:
+    """An MQTT command message, the parent span of the commands it starts."""
+
+    __slots__ = ("topic", "trace_id", "span_id", "received", "dispatched", "exported")
+
+    def __init__(self, topic, received):
+        self.topic = topic
+        self.trace_id = os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.received = received        # paho's monotonic receive time
+        self.dispatched = None          # on_message done
+        self.exported = False
+
+class CommandTrace:
+    """Monotonic timestamps of one command, from queueing to its verification."""
+
+    __slots__ = ("name", "message", "span_id", "queued", "started", "sent",
+                 "confirmed", "done", "attempts", "result")
+
+    def __init__(self, name, message=None):
+        self.name = name
+        self.message = message
+        self.span_id = os.urandom(8).hex()
+        self.queued = time.monotonic()
+        self.started = None
+        self.sent = None            # first Wait: the command's frames are written
+        self.confirmed = None       # a Wait was satisfied by a received frame
+        self.done = None
+        self.attempts = 0
+        self.result = None
+
+    def waiting(self):
+        self.attempts += 1
+        if self.sent is None:
+            self.sent = time.monotonic()
+
+    def waited(self, ok):
+        if ok and self.confirmed is None:
+            self.confirmed = time.monotonic()
+
+    @property
+    def received(self):
+        return self.message.received if self.message else None
+
+    @property
+    def dispatched(self):
+        return self.message.dispatched if self.message else None
+
+    def stage(self, name):
+        start, end = TRACE_STAGES[name]
+        t0, t1 = getattr(self, start), getattr(self, end)
+        return None if t0 is None or t1 is None else t1 - t0
+
+class CommandTracer:
+    """Per command latency histograms on diagnostics/commands, optional span export."""
+
+    def __init__(self, ca):
+        self.ca = ca
+        self.stats = {}     # command -> [Histogram, {stage: [count, total s]}, failed, last s]
+
+    def finish(self, trace, result):
+        trace.done = time.monotonic()
+        trace.result = result
+        start = trace.received if trace.received is not None else trace.queued
+        total = trace.done - start
+
+        stats = self.stats.get(trace.name)
+        if stats is None:
+            stats = self.stats[trace.name] = [Histogram(COMMAND_LATENCY_BUCKETS), {}, 0, 0.0]
+        stats[0].observe(total)
+        for name in TRACE_STAGES:
+            seconds = trace.stage(name)
+            if seconds is not None:
+                entry = stats[1].setdefault(name, [0, 0.0])
+                entry[0] += 1
+                entry[1] += seconds
+        if result is False:
+            stats[2] += 1
+        stats[3] = total
+
+        log.debug(
+            f"Trace {trace.name}: {total * 1000:.0f} ms, "
+            + ", ".join(
+                f"{name} {trace.stage(name) * 1000:.0f} ms"
+                for name in TRACE_STAGES if trace.stage(name) is not None
             )
+        )
+        self.publish()
+        if TRACE_SPANS:
+            self.export(trace)
+
+    def publish(self):
+        report = {}
+        for name, (hist, stages, failed, last) in self.stats.items():
+            buckets = {}
+            running = 0
+            for bound, n in zip(hist.bounds, hist.counts):
+                running += n
+                buckets[str(bound)] = running
+            buckets["+Inf"] = hist.count
+            report[name] = {
+                "count": hist.count,
+                "failed": failed,
+                "avg_ms": round(hist.sum / hist.count * 1000, 1),
+                "last_ms": round(last * 1000, 1),
+                "buckets": buckets,
+                "stages_avg_ms": {
+                    stage: round(total / count * 1000, 1) for stage, (count, total) in stages.items()
+                },
+            }
+        self.ca.mqtt.publish("diagnostics/commands", json.dumps(report), retain=False)
+
+    def export(self, trace):
+        # one OTLP JSON export request per line, like the collector's file exporter
+        offset = time.time() - time.monotonic()
+
+        def nanos(t):
+            return str(int((t + offset) * 1e9))
+
+        message = trace.message
+        trace_id = message.trace_id if message else os.urandom(16).hex()
+        spans = []
+        if message and not message.exported:
+            message.exported = True
+            spans.append({
+                "traceId": trace_id,
+                "spanId": message.span_id,
+                "name": f"mqtt {message.topic}",
+                "kind": 5,      # consumer
+                "startTimeUnixNano": nanos(message.received),
+                "endTimeUnixNano": nanos(message.dispatched or message.received),
+                "attributes": [
+                    {"key": "messaging.destination.name", "value": {"stringValue": message.topic}},
+                ],
+            })
+        events = [
+            {"timeUnixNano": nanos(t), "name": name}
+            for name, t in (("started", trace.started), ("sent", trace.sent), ("confirmed", trace.confirmed))
+            if t is not None
+        ]
+        attributes = [
+            {"key": "ca350.unit", "value": {"stringValue": self.ca.unit.id}},
+            {"key": "ca350.command", "value": {"stringValue": trace.name}},
+            {"key": "ca350.attempts", "value": {"intValue": str(trace.attempts)}},
+            {"key": "ca350.result", "value": {"stringValue": str(trace.result)}},
+        ]
+        for name in TRACE_STAGES:
+            seconds = trace.stage(name)
+            if seconds is not None:
+                attributes.append({"key": f"ca350.{name}_ms", "value": {"doubleValue": round(seconds * 1000, 3)}})
+        span = {
+            "traceId": trace_id,
+            "spanId": trace.span_id,
+            "name": f"command {trace.name}",
+            "kind": 1,          # internal
+            "startTimeUnixNano": nanos(trace.queued),
+            "endTimeUnixNano": nanos(trace.done),
+            "attributes": attributes,
+            "events": events,
+            "status": {"code": 2 if trace.result is False else 1},
+        }
+        if message:
+            span["parentSpanId"] = message.span_id
+        spans.append(span)
+        TRACE_FILE.write(json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "ca350_mqtt_bridge"}}]},
+            "scopeSpans": [{"scope": {"name": "ca350"}, "spans": spans}],
+        }]}))
+
+class TraceFile:
+    """Span lines of all units appended by one writer thread.
+
+    The command runner (the event loop in the asyncio runtime) only queues
+    the line; the thread writes whatever is waiting in one go.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue(TRACE_QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.writer = None
+        self.dropped = 0
+
+    def write(self, line):
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+            return
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.run, name="trace-writer", daemon=True)
+                self.writer.start()
+
+    def run(self):
+        while True:
+            lines = [self.queue.get()]
+            while len(lines) < TRACE_QUEUE_SIZE:
+                try:
+                    lines.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in lines
+            lines = [line for line in lines if line is not None]
+            if lines:
+                self.append(lines)
+            if stop:
+                return
+
+    def append(self, lines):
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) > TRACE_FILE_MAX:
+                os.replace(self.path, self.path + ".1")
+            with open(self.path, "a") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError as e:
+            log.warning(f"Trace export failed: {e}")
+
+    def close(self):
+        # at shutdown: write what is queued
+        with self.lock:
+            writer = self.writer
+        if writer:
+            self.queue.put(None)
+            writer.join(2)
+
+TRACE_FILE = TraceFile(os.path.join(DATA_DIR, "ca350_traces.jsonl"))
+
+# ================== TX BATCHING ==================
+
+class TxBatcher:
+    """Frames written within the window are sent with one sendall, one TCP segment.
+
+    write(urgent=True) and flush() send everything pending at once, so frames
+    of one writer keep their order. The lock only guards the pending list:
+    one caller at a time sends, frames written meanwhile leave with its next
+    round, so a stalled socket blocks that sender and nobody else. Threads
+    runtime: a flusher thread, started on first use, sends what is left
+    when the window ends.
+    """
+
+    def __init__(self, send, window):
+        self.send = send
+        self.window = window
+        self.pending = []
+        self.lock = threading.Lock()
+        self.sending = False
+        self.frames = 0
+        self.segments = 0
+        self.due = threading.Event()
+        self.flusher = None
+
+    def write(self, frame, urgent=False):
+        with self.lock:
+            self.pending.append(frame)
+            if not urgent and self.window:
+                if len(self.pending) == 1:
+                    self.arm()
+                return
+        self.send_pending()
+
+    def write_group(self, frames):
+        with self.lock:
+            self.pending.extend(frames)
+        self.send_pending()
+
+    def flush(self):
+        self.send_pending()
+
+    def send_pending(self):
+        with self.lock:
+            if self.sending:
+                return      # the active sender takes these along
+            self.sending = True
+        while True:
+            with self.lock:
+                pending = self.pending
+                if not pending:
+                    self.sending = False    # together with the check, no frame is left behind
+                    return
+                self.pending = []
+                self.frames += len(pending)
+                self.segments += 1
+            try:
+                self.send(pending[0] if len(pending) == 1 else b"".join(pending))
+            except Exception:
+                with self.lock:
+                    self.sending = False
+                raise
+
+    def saved(self):
+        return self.frames - self.segments
+
+    def arm(self):
+        if self.flusher is None:
+            self.flusher = threading.Thread(target=self.run, name="ca350-tx", daemon=True)
+            self.flusher.start()
+        self.due.set()
+
+    def run(self):
+        while True:
+            self.due.wait()
+            self.due.clear()
+            time.sleep(self.window)
+            try:
+                self.flush()
+            except Exception as e:
+                log.debug(f"TX flush failed: {e}")
 
 # ================== CA350 CLIENT ==================
 
+def tune_socket(sock):
+    # notice a dead gateway within seconds instead of the kernel's two hours
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    for name, value in (
+        ("TCP_KEEPIDLE", KEEPALIVE_IDLE),
+        ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+        ("TCP_KEEPCNT", KEEPALIVE_PROBES),
+        ("TCP_USER_TIMEOUT", TCP_WRITE_TIMEOUT_MS),
+    ):
+        if hasattr(socket, name):     # Linux
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+class Wait:
+    """Command step: wait until check() is true or timeout passes.
+
+    The runner re-evaluates check each time a frame updating field has
+    been decoded and sends the final result back into the command.
+    """
+
+    __slots__ = ("field", "check", "timeout")
+
+    def __init__(self, field, check, timeout):
+        self.field = field
+        self.check = check
+        self.timeout = timeout
+
+def command(proc):
+    """Turn a generator method into a command run by the client's runner.
+
+    The generator yields the seconds to sleep or a Wait, so the same
+    command runs on the executor's worker thread or as a task in the
+    asyncio runtime. Calling a command queues it and returns a future.
+    """
+    @functools.wraps(proc)
+    def run(self, *args, **kwargs):
+        trace = CommandTrace(proc.__name__, current_message.get())
+        return self.run_command(proc(self, *args, **kwargs), trace)
+    return run
+
 class CA350Client:
     START = b"\x07\xF0"
     END = b"\x07\x0F"
 
     @staticmethod
     def stuff_data(data: bytes) -> bytes:
-        stuffed = bytearray()
-        for b in data:
-            stuffed.append(b)
-            if b == 0x07:
-                stuffed.append(0x07)
-        return bytes(stuffed)
+        return bytes(data).replace(b"\x07", b"\x07\x07")
         
     @staticmethod
     def calc_checksum(cmd: bytes, length: int, data: bytes) -> int:
-        total = sum(cmd) + length
-        skip_next_07 = False
-
-        for b in data:
-            if b == 0x07:
-                if skip_next_07:
-                    skip_next_07 = False
-                    continue
-                total += b
-                skip_next_07 = True
-            else:
-                skip_next_07 = False
-                total += b
-
-        total += 173
+        # a 07 right after a counted 07 is not counted (v1.8.2), so each
+        # non-overlapping 07 07 pair adds 07 only once
+        total = sum(cmd) + length + sum(data) + 173
+        if 0x07 in data:
+            total -= 0x07 * bytes(data).count(b"\x07\x07")
         return total & 0xFF
 
     @classmethod
@@ -476,52 +1714,148 @@ class CA350Client:
             cls.END
         )
 
-    def __init__(self, host, port, mqtt_client):
+    @staticmethod
+    @functools.lru_cache(maxsize=128)
+    def cached_frame(cmd: bytes, data: bytes = b"") -> bytes:
+        # frames with a small set of values (fan level, temperature, pc mode)
+        return CA350Client.build_frame(cmd, data)
+
+    def __init__(self, host, port, mqtt_client, unit=None):
         self.host = host
         self.port = port
         self.mqtt = mqtt_client
+        self.unit = unit or UNITS[0]
+        self.send_acks = not self.unit.comfosense     # CC Ease emulation acknowledges frames
         self.sock = None
         self.running = False
         self.rx_thread = None
-        self.buffer = bytearray()
+        # received bytes live in rx_buf[rx_start:rx_end], parsed in place
+        self.rx_buf = bytearray(RX_BUF_SIZE)
+        self.rx_view = memoryview(self.rx_buf)
+        self.rx_start = 0
+        self.rx_end = 0
+        self.rx_resyncs = 0
+        self.rx_dropped = 0
+        self.rx_bytes = 0
+        self.rx_time = 0.0          # perf_counter of the last receive
+        self.rx_frames = {}         # cmd -> frames received
+        self.rx_latency = Histogram(RX_LATENCY_BUCKETS)
+        self.checksum_errors = 0
+        self.link = Link(self.unit.id, self.unit.label, self.open)
+        self.link_timeout = LINK_TIMEOUT or (
+            LINK_TIMEOUT_COMFOSENSE if self.unit.comfosense else LINK_TIMEOUT_EMULATION
+        )
+        self.link_stalls = 0
+        self.capture = make_capture(self.unit)
+        self.snapshot = make_snapshot(self.unit)
+        self.frame_log = FrameLog(FRAME_LOG_SIZE, self.unit.id) if FRAME_LOG_SIZE > 0 else None
         self.lock = threading.Lock()
-        self.seen_commands = set()
-        self.current_fan_level = None
-        self.current_comfo_temp_c = None
-        self.current_comfo_temp_raw = None
-        self.current_RS232_mode = None
-        self.current_airflow_mode = None
-        self.current_booster = False
-        self.filter_warn = False
-        self.current_booster_time = None
-        self.delay_values = None
-        self.current_filter_time = None
+        self.tx = self.make_batcher()
+        self.executor = self.make_executor()
+        self.tracer = CommandTracer(self)
+        self.state = DeviceState()
+        self.groups = {group: {} for group in set(KEY_GROUPS.values())}
+        self.decoding = None        # group of the frame being decoded, published once at the end
+        self.waiters = {}           # state field -> events of waiting commands
+        self.verify_latency = {}    # command -> [count, total s, max s]
         self.shutting_down = False
         self.button_state = 0x02
-        self.auto_mode = None
-        self.manual_mode = None
+        self.poll_burst_until = 0.0
+        self.scheduler = None
+        self.unseen = set(FULL_STATE)   # frames not decoded since start
+        self.awaiting = set()           # responses read_state still waits for
+        self.delays_live = False        # delay_values received since connect, not from the snapshot
+        self.startup = None             # Startup until the bridge is ready
 
     # ---------- CONNECTION ----------
     
     def connect(self):
         if self.running:
             return
-        log.info("Connecting to CA350...")
+        log.info(f"Connecting to {self.unit.label}...")
         
         try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.connect((self.host, self.port))
-            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) #new
-            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) #new
-            self.running = True
-            self.rx_thread = threading.Thread(target=self.rx_loop, daemon=True)
-            self.rx_thread.start()
-            log.info("Connected to CA350")
+            self.open()
         except Exception as e:
-            log.error(f"Connect failed: {e}")
+            log.error(f"{self.unit.label} connect failed: {e}")
+            self.link.down()
+
+    def open(self):
+        # first connect and the supervisor's reconnects, raises on failure
+        self.sock = socket.create_connection((self.host, self.port), CONNECT_TIMEOUT)
+        self.sock.settimeout(None)
+        tune_socket(self.sock)
+        self.running = True
+        self.rx_thread = threading.Thread(target=self.rx_loop, daemon=True)
+        self.rx_thread.start()
+        log.info(f"Connected to {self.unit.label}")
+        self.link_up()
+
+    def link_up(self):
+        if self.capture:
+            self.capture.mark()
+        self.rx_time = time.perf_counter()      # liveness counts from the connect
+        # up before online: an MQTT connect in between publishes the state from link.is_up
+        recovered = self.link.up()
+        self.delays_live = False
+        self.mqtt.publish("availability", "online", retain=True)
+        if self.startup:
+            self.startup.mark(self.unit.id, "connected")
+        if recovered and self.scheduler:
+            self.scheduler.run_soon(f"{self.unit.id}:poll")
+        self.restore()
+
+    def link_down(self):
+        if self.frame_log:
+            self.frame_log.dump("disconnect", auto=True)
+        if not self.shutting_down:
+            self.mqtt.publish("availability", "offline", retain=True)
+        self.link.down()
+
+    def check_liveness(self):
+        # watchdog job: a half-open socket or a power-cycled gateway sends nothing
+        if not self.running:
+            return
+        idle = time.perf_counter() - self.rx_time
+        if idle < self.link_timeout:
+            return
+        self.link_stalls += 1
+        log.warning(f"{self.unit.label}: nothing received for {idle:.1f} s, reconnecting")
+        self.abort()
+
+    def liveness_due(self):
+        # seconds until check_liveness can find a stall
+        return self.link_timeout - (time.perf_counter() - self.rx_time)
+
+    def abort(self):
+        # wakes the blocked recv, rx_loop then reports the loss
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def restore(self):
+        # every connect, the first included: the unit or the gateway may have
+        # restarted, so the RS232 mode is set and all values are read again
+        for ca, mode in pc_modes([self]):
+            self.track("pc_mode", ca.set_pc_mode(mode))
+        self.track("state", self.read_state())
+
+    def track(self, milestone, future):
+        # startup milestone reached when the command is done, failed or not
+        if self.startup:
+            future.add_done_callback(lambda f: self.startup.mark(self.unit.id, milestone))
+
+    def when_connected(self, fn):
+        # scheduled work that only makes sense with the gateway connected
+        def job():
+            if self.running:
+                fn()
+        return job
 
     def stop(self):
-        log.info("Stopping CA350 client...")
+        log.info(f"Stopping {self.unit.label} client...")
+        self.log_tx_stats()
         self.shutting_down = True
         self.running = False
         try:
@@ -529,349 +1863,387 @@ class CA350Client:
                 self.sock.close()
         except:
             pass
+        if self.capture:
+            self.capture.close()
+        if self.snapshot:
+            self.snapshot.close()
         
     # ---------- RX LOOP ----------
     
     def rx_loop(self):
         while self.running:  
             try:
-                data = self.sock.recv(256)  
-                if not data:
+                n = self.sock.recv_into(self.rx_space())
+                if not n:
                     raise ConnectionError("Socket closed")   
-                self.buffer.extend(data)
+                self.rx_time = time.perf_counter()
+                self.rx_bytes += n
+                if self.capture:
+                    self.capture.write(self.rx_view[self.rx_end:self.rx_end + n])
+                self.rx_end += n
                 self.process_buffer()
     
             except Exception as e:  
                 if not self.running:
                     break 
-                log.warning(f"CA350 connection lost: {e}")   
+                log.warning(f"{self.unit.label} connection lost: {e}")   
                 self.running = False 
                 try:
                     self.sock.close()
                 except:
                     pass   
-                # reconnect loop
-                while not self.running:
-                    log.info("Reconnecting to CA350...")
-                    try:
-                        self.connect()
-                        return
-                    except:
-                        time.sleep(3)
+                # the supervisor reconnects, this thread ends
+                self.link_down()
+                return
 
     # ---------- FRAME PARSER ----------
 
+    def rx_space(self):
+        # free tail of the receive buffer, move pending bytes to the front if short
+        if RX_BUF_SIZE - self.rx_end < RX_CHUNK:
+            pending = self.rx_end - self.rx_start
+            self.rx_buf[:pending] = self.rx_buf[self.rx_start:self.rx_end]
+            self.rx_start = 0
+            self.rx_end = pending
+        return self.rx_view[self.rx_end:]
+
+    def feed(self, data):
+        # push bytes through the parser as if received (replay, benchmarks)
+        self.rx_time = time.perf_counter()
+        self.rx_bytes += len(data)
+        view = memoryview(data)
+        while view:
+            space = self.rx_space()
+            n = min(len(space), len(view))
+            space[:n] = view[:n]
+            self.rx_end += n
+            view = view[n:]
+            self.process_buffer()
+
     def process_buffer(self):
+        buf = self.rx_buf
+        view = self.rx_view
+        end = self.rx_end
+        pos = self.rx_start
+
         while True:
 
-            start = self.buffer.find(self.START)
+            start = buf.find(self.START, pos, end)
             if start == -1:
-                self.buffer.clear()
-                return
-
-            if start > 0:
-                del self.buffer[:start]
-
-            if len(self.buffer) < 5:
-                return
-
-            cmd = bytes(self.buffer[2:4])
-            length = self.buffer[4]
-
-            i = 5
-            decoded = bytearray()
-
-            while len(decoded) < length:
-
-                if i >= len(self.buffer):
-                    return
+                # keep a trailing 07, it may be the first half of the next start
+                keep = end - 1 if end > pos and buf[end - 1] == 0x07 else end
+                self.rx_dropped += keep - pos
+                pos = keep
+                break
 
-                b = self.buffer[i]
+            self.rx_dropped += start - pos
+            pos = start
 
-                if b == 0x07:
-                    if i + 1 >= len(self.buffer):
-                        return
+            if end - pos < 5:
+                break
 
-                    nxt = self.buffer[i + 1]
+            length = buf[pos + 4]
+
+            # walk the stuffed data, jumping from one 07 to the next
+            i = pos + 5
+            need = length
+            escaped = False
+            resync = False
+            while need:
+                esc = buf.find(0x07, i, min(i + need, end))
+                if esc == -1:
+                    i += need
+                    break
+                need -= esc - i
+                if esc + 1 >= end:
+                    i = end
+                    break
+                if buf[esc + 1] != 0x07:
+                    resync = True
+                    break
+                escaped = True
+                need -= 1
+                i = esc + 2
+
+            if resync:
+                log.debug("Invalid escape sequence, resync")
+                if self.frame_log:
+                    self.frame_log.add(view[pos:esc + 2], FRAME_RESYNC)
+                self.rx_resyncs += 1
+                self.rx_dropped += 1
+                pos += 1
+                continue
 
-                    if nxt == 0x07:
-                        decoded.append(0x07)
-                        i += 2
-                    else:
-                        log.debug("Invalid escape sequence, resync")
-                        del self.buffer[0]
-                        break
-                else:
-                    decoded.append(b)
-                    i += 1
+            if i + 3 > end:
+                break
 
-            if i + 3 > len(self.buffer):
-                return
+            if buf[i + 1] != 0x07 or buf[i + 2] != 0x0F:
+                log.debug("Frame sync lost, resync")
+                if self.frame_log:
+                    self.frame_log.add(view[pos:i + 3], FRAME_RESYNC)
+                self.rx_resyncs += 1
+                self.rx_dropped += 1
+                pos += 1
+                continue
 
-            checksum = self.buffer[i]
-            end = self.buffer[i + 1:i + 3]
+            if escaped:
+                data = bytes(view[pos + 5:i]).replace(b"\x07\x07", b"\x07")
+            else:
+                data = view[pos + 5:i]
 
-            if end != self.END:
-                log.debug("Frame sync lost, dropping 1 byte")
-                del self.buffer[0]
-                continue
+            cmd = bytes(view[pos + 2:pos + 4])
+            checksum = buf[i]
+            raw = view[pos:i + 3]
+            pos = i + 3
 
-            raw_frame = bytes(self.buffer[:i + 3])
-            del self.buffer[:i + 3]
+            self.handle_frame(cmd, length, data, checksum, raw)
 
-            self.handle_frame(cmd, length, bytes(decoded), checksum, raw_frame)
+        if pos == end:
+            self.rx_start = self.rx_end = 0
+        else:
+            self.rx_start = pos
 
     # ---------- FRAME HANDLER ----------
 
     def handle_frame(self, cmd, length, data, checksum, raw):
+        # data and raw may be views into rx_buf, only valid during this call
 
-        self.seen_commands.add(cmd)
+        self.rx_frames[cmd] = self.rx_frames.get(cmd, 0) + 1
 
         calc = self.calc_checksum(cmd, length, data)
         if calc != checksum:
-            log.warning(f"Checksum error: {raw.hex(' ')}")
+            self.checksum_errors += 1
+            log.warning(f"{self.unit.label} checksum error: {raw.hex(' ')}")
+            if self.frame_log:
+                self.frame_log.add(raw, FRAME_CHECKSUM)
+                self.frame_log.checksum_error()
             return
-        if not Comfosense_connected: 
+        if self.frame_log:
+            self.frame_log.add(raw)
+        if self.send_acks:
             # ACK senden
             self.send_ack()
 
-        self.decode_frame(cmd, data)
+        # only frames from the unit count towards the full state, not the snapshot
+        if not self.decode_frame(cmd, data):
+            return
+        if cmd == b"\x00\xCA" and not self.delays_live:
+            self.delays_live = True
+            self.notify("delay_values")
+        if self.unseen and cmd in self.unseen:
+            self.first_seen(cmd)
+        if self.awaiting and cmd in self.awaiting:
+            self.awaiting.discard(cmd)
+            if not self.awaiting:
+                self.notify("state")
 
     # ---------- STATUS FRAMES ----------
 
     def decode_frame(self, cmd: bytes, data: bytes):
-        log.debug(f"RX {cmd.hex(' ')} DATA={data.hex(' ')}")
-
-        # Ventilation Status
-        if cmd == b"\x00\xCE" and len(data) >= 14:
-            
-            exhaust = data[6]
-            intake = data[7]
-            fan = data[8]
-            
-            log.debug(f"Exhaust(%) = {exhaust}")
-            log.debug(f"Intake(%) = {intake}")
-            log.debug(f"Fan = {fan}")
-
-            self.current_fan_level = fan
-
-            self.publish("fan_level", str(fan))
-            self.publish("intake_fan", str(intake))
-            self.publish("exhaust_fan", str(exhaust))
-
-            # Derive fan_mode string for HA climate
-            if fan == 1:
-                fan_mode = "off"
-            elif fan == 2:
-                fan_mode = "low"
-            elif fan == 3:
-                fan_mode = "medium"
-            else:
-                fan_mode = "high"
+        # True if the frame was decoded
+        if DEBUG:
+            log.debug(f"RX {cmd.hex(' ')} DATA={data.hex(' ')}")
 
-            self.publish("fan_mode", fan_mode)
+        decoder = DECODERS.get(cmd)
+        if decoder is None or len(data) < decoder.size:
+            return
 
-            # Derive hvac_mode for HA
-            # off = fan level 1 and booster off
-            if fan == 1 and not self.current_booster:
-                mode = "off"
-            else:
-                mode = "fan_only"          
-            self.publish("hvac_mode", mode)
+        values = decoder.unpack(data)
+        if DEBUG:
+            log.debug(f"{decoder.name} = {values}")
+
+        if JSON_STATE and decoder.group:
+            self.decoding = decoder.group
+        if decoder.hook:
+            decoder.hook(self, values)
+        publish = self.publish
+        for index, key, convert in decoder.fields:
+            publish(key, convert(values[index]))
+        if self.decoding:
+            self.decoding = None
+            self.publish_group(decoder.group)
+        self.rx_latency.observe(time.perf_counter() - self.rx_time)
+        if decoder.persist and self.snapshot and self.snapshot.update(cmd, data):
+            self.save_snapshot_later()
+        if decoder.notify:
+            self.notify(*decoder.notify)
+        return True
 
-        # Temperature Status
-        elif cmd == b"\x00\xD2" and len(data) >= 9:
-            def temp(x): return (x / 2) - 20
+    def first_seen(self, cmd):
+        self.unseen.discard(cmd)
+        if self.unseen:
+            return
+        if self.startup:
+            self.startup.mark(self.unit.id, "full_state")
+        self.notify("state")
 
-            comfosense_raw = data[0]
-            comfosense_c = temp(comfosense_raw)
+    # ---------- STATE SNAPSHOT ----------
 
-            outside = temp(data[1])
-            supply = temp(data[2])
-            extract = temp(data[3])
-            exhaust = temp(data[4])
-            
-            log.debug(f"Comfosense Temp. = {comfosense_c} °C")
-            log.debug(f"Outside Temp. = {outside} °C")
-            log.debug(f"Supply Temp. = {supply} °C")
-            log.debug(f"Extract Temp. = {extract} °C")
-            log.debug(f"Exhaust Temp. = {exhaust} °C")
-
-            self.current_comfo_temp_raw = comfosense_raw
-            self.current_comfo_temp_c = comfosense_c
-
-            self.publish("comfort_temp", str(round(comfosense_c, 1)))
-            self.publish("outside_temp", str(round(outside, 1)))
-            self.publish("supply_temp", str(round(supply, 1)))
-            self.publish("extract_temp", str(round(extract, 1)))
-            self.publish("exhaust_temp", str(round(exhaust, 1)))
-
-        # Bypass
-        elif cmd == b"\x00\xE0" and len(data) >= 7:
-            bypass = data[3]
-            self.publish("bypass", str(bypass))
-            self.publish("bypass_active_bin", "ON" if bypass>0 else "OFF")                                                              
-            log.debug(f"Bypass = {bypass}")
-            summer_mode= data[6]
-            self.publish("summer_mode_bin", "ON" if summer_mode==1 else "OFF")
-            log.debug(f"summer_mode= {summer_mode}")
-
-        # RS232 mode
-        elif cmd == b"\x00\x9C" and len(data) >= 1:
-            RS232_mode = data[0]
-            self.current_RS232_mode = RS232_mode
-            self.publish("rs232_mode", str(RS232_mode))
-            log.debug(f"RS232 mode = {RS232_mode}")
-          
-        # States from Display commands
-        elif cmd == b"\x00\x3C" and len(data) >= 10:
-        
-            #Airflow mode
-            flags = data[9]
-            In = bool(flags & 0x40)
-            Out = bool(flags & 0x80)
-        
-            if In and Out:
-                mode = "In and Out"
-            elif In:
-                mode = "In"
-            elif Out:
-                mode = "Out"
-            else:
-                mode = "unknown"
-        
-            self.current_airflow_mode = mode
-        
-            log.debug(f"Airflow mode = {mode}")
-            self.publish("airflow_mode", mode)
-            
-            #Booster status
-            booster_active = (data[8] & 0x78) == 0x78
-            self.current_booster = booster_active
-            if booster_active:
-                self.publish("preset_mode", "boost")
-            else:
-                self.publish("preset_mode", "none")
-            self.publish("booster_active_bin", "ON" if self.current_booster else "OFF")                                                                          
-            log.debug(f"Booster = {'ON' if booster_active else 'OFF'}")
-            
-            #Filter status / fan mode status
-            flags = data[1]
-            filter_flag = bool(flags & 0x20)
-            
-            if filter_flag:
-                filter_state = "Full"
-                self.filter_warn = True
-            else:
-                filter_state = "OK"
-                self.filter_warn = False                                
-                
-            log.debug(f"Filter = {filter_state}")
-            self.publish("filter_warning_bin", "ON" if self.filter_warn else "OFF")
-        
-            self.auto_mode = bool(flags & 0x08)
-            self.manual_mode = bool(flags & 0x10)
-                    
-            mode = "AUTO" if self.auto_mode else "MANUAL"
-            self.publish("ventilation_mode", mode)
-        # Preheater / Frost protection status
-        elif cmd == b"\x00\xE2" and len(data) >= 6:
-        
-            flap_status = data[0]   # 1=open / 0=closed / 2=unknown
-            frost_protection = data[1]   # 1=active / 0=inactive
-            preheat = data[2]    # 1=active / 0=inactive
-        
-            frost_minutes = (data[3] << 8) | data[4]   # Bytes 4-5
-        
-            flap_txt = {0: "closed", 1: "open", 2: "unknown"}.get(flap_status, str(flap_status))
-        
-            log.debug(f"Preheater flap = {flap_txt}")
-            log.debug(f"Frost protection = {'ON' if frost_protection == 1 else 'OFF'}")
-            log.debug(f"Preheater active = {'ON' if preheat == 1 else 'OFF'}")
-            log.debug(f"Frost minutes = {frost_minutes} min")
-        
-            # MQTT publish
-            self.publish("preheater_flap", flap_txt)
-            self.publish("frost_protection_bin", "ON" if frost_protection == 1 else "OFF")
-            self.publish("preheat_active_bin", "ON" if preheat == 1 else "OFF")
-            self.publish("frost_minutes", str(frost_minutes))
-
-        #act delay times
-        elif cmd == b"\x00\xCA" and len(data) >= 8:
-            self.delay_values = list(data[:8])    
-            booster_time = data[3]   
-            filter_time = data[4]
-            log.debug(f"Booster time = {booster_time} min")    
-            log.debug(f"Filter time = {filter_time} weeks")   
-            self.current_booster_time = booster_time   
-            self.current_filter_time = filter_time 
-            self.publish("booster_time", str(booster_time))
-            self.publish("filter_time", str(filter_time))
-          
-        #Operating hours    
-        elif cmd == b"\x00\xDE" and len(data) >= 20:
-            def get_3byte(idx):
-                return (data[idx] << 16) | (data[idx+1] << 8) | data[idx+2]      
-            def get_2byte(idx):
-                return (data[idx] << 8) | data[idx+1]
-        
-            hours_away = get_3byte(0)
-            hours_low = get_3byte(3)
-            hours_medium = get_3byte(6)
-            hours_frost = get_2byte(9)
-            hours_preheat = get_2byte(11)
-            hours_bypass = get_2byte(13)
-            hours_filter = get_2byte(15)
-            hours_high = get_3byte(17)
-            log.debug("Operating hours received") 
-        
-            self.publish("hours_away", hours_away)
-            self.publish("hours_low", hours_low)
-            self.publish("hours_medium", hours_medium)
-            self.publish("hours_frost", hours_frost)
-            self.publish("hours_preheat", hours_preheat)
-            self.publish("hours_bypass", hours_bypass)
-            self.publish("hours_filter", hours_filter)
-            self.publish("hours_high", hours_high)
+    def load_snapshot(self):
+        # warm start: last delay times and operating hours until the unit answers
+        if not self.snapshot:
+            return
+        self.rx_time = time.perf_counter()
+        for cmd, data in self.snapshot.load():
+            self.decode_frame(cmd, data)
+
+    def save_snapshot_later(self):
+        # rate limited; without a scheduler yet the change is saved with the next one or at stop
+        snap = self.snapshot
+        if self.scheduler and not snap.pending:
+            snap.pending = True
+            self.scheduler.once(f"{self.unit.id}:save_state", snap.save, snap.save_delay())
+
+    def dump_frames(self, reason):
+        if self.frame_log:
+            self.frame_log.dump(reason)
+        else:
+            log.warning("Frame log disabled (frame_log_size = 0)")
 
     # ---------- MQTT PUBLISH ----------
 
-    def publish(self, key, value):
+    def publish(self, key, value, force=False):
         if self.shutting_down:
             return
-        self.mqtt.publish(f"status/{key}", value)
+        payload = str(value)
+        if JSON_STATE:
+            group = KEY_GROUPS.get(key)
+            if group:
+                self.groups[group][key] = payload
+                if group != self.decoding:
+                    self.publish_group(group)
+                return
+        if self.state.changed(key, payload, force):
+            self.mqtt.publish(f"status/{key}", payload)
+
+    def publish_group(self, group):
+        # the group's JSON is tracked like a single value, heartbeat included;
+        # held back until every key is known (heat_recovery comes from two frames)
+        values = self.groups[group]
+        if len(values) < GROUP_SIZES[group]:
+            return
+        payload = json.dumps(values, separators=(",", ":"))
+        if self.state.changed(group, payload):
+            self.mqtt.publish(f"status/{group}", payload)
+
+    def republish_state(self):
+        # heartbeat: send every known value again, changed or not
+        state = self.state
+        for key, payload in list(state.published.items()):
+            self.publish(key, payload, force=True)
+        log.debug(
+            f"Publish stats: {state.publish_count} published, "
+            f"{state.suppressed_count} suppressed"
+        )
+
+    # ---------- TX / COMMAND RUNNER ----------
+
+    def write(self, frame, urgent=False):
+        # called from the scheduler, rx thread (ACK) and command worker
+        self.tx.write(frame, urgent)
+
+    def write_group(self, *frames):
+        # frames that belong together (button press + release, poll pair): one segment, now
+        self.tx.write_group(frames)
+
+    def make_batcher(self):
+        return TxBatcher(self.send_bytes, TX_BATCH_WINDOW)
+
+    def send_bytes(self, data):
+        self.sock.sendall(data)
+
+    def make_executor(self):
+        return CommandExecutor(self)
+
+    def run_command(self, proc, trace):
+        return self.executor.submit(proc, trace)
+
+    def drive(self, proc, trace):
+        try:
+            step = next(proc)
+            while True:
+                # the command wrote all frames of this step, don't wait for the window
+                self.tx.flush()
+                if isinstance(step, Wait):
+                    trace.waiting()
+                    self.poll_burst()
+                    ok = self.wait_for(step)
+                    trace.waited(ok)
+                    step = proc.send(ok)
+                else:
+                    time.sleep(step)
+                    step = proc.send(None)
+        except StopIteration as e:
+            self.tx.flush()
+            return e.value
+
+    # ---------- STATE WAITERS ----------
+
+    def notify(self, *fields):
+        # called by decode_frame, wakes commands waiting on these fields
+        for field in fields:
+            waiters = self.waiters.get(field)
+            if waiters:
+                for event in tuple(waiters):
+                    event.set()
+
+    def wait_for(self, step):
+        event = threading.Event()
+        waiters = self.waiters.setdefault(step.field, [])
+        waiters.append(event)
+        deadline = time.monotonic() + step.timeout
+        try:
+            while not step.check():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not event.wait(remaining):
+                    return step.check()
+                event.clear()
+            return True
+        finally:
+            waiters.remove(event)
+
+    def record_verify(self, kind, started):
+        latency = time.monotonic() - started
+        stats = self.verify_latency.setdefault(kind, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += latency
+        stats[2] = max(stats[2], latency)
+        return latency
 
     # ---------- VERIFIED SEND ----------
 
-    def send_verified(self, frame, check_fn, name):
+    def send_verified(self, frame, field, check_fn, name):
+        # generator, use with "yield from" inside a command
+        started = time.monotonic()
         for attempt in range(1, 4):
-            self.sock.send(frame)
+            self.write(frame)
             log.info(f"Sent {name} (try {attempt})")
 
-            for _ in range(20):
-                if check_fn():
-                    log.info(f"{name} verified")
-                    return True
-                time.sleep(0.2)
+            if (yield Wait(field, check_fn, 4.0)):
+                latency = self.record_verify(field, started)
+                log.info(f"{name} verified in {latency * 1000:.0f} ms")
+                return True
 
         log.warning(f"{name} failed after 3 tries")
         return False
 
     # ---------- COMMANDS ----------
 
+    @command
     def set_fan_level(self, level: int):
         if level not in [1, 2, 3, 4]:
             return
 
-        data = bytes([level])
-        frame = self.build_frame(b"\x00\x99", data)
+        frame = self.cached_frame(b"\x00\x99", bytes([level]))
 
-        self.send_verified(
+        return (yield from self.send_verified(
             frame,
-            lambda: self.current_fan_level == level,
+            "fan_level",
+            lambda: self.state.fan_level == level,
             f"Fan level {level}"
-        )
+        ))
 
+    @command
     def set_temperature(self, temp_c: float):
         if not (15 <= temp_c <= 27):
             log.warning(f"Wrong temperature provided: {temp_c}. No changes made")
@@ -879,32 +2251,34 @@ class CA350Client:
 
         # Device expects raw = temp*2 + 40
         val = int(round(temp_c * 2 + 40))
-        data = bytes([val])
-        frame = self.build_frame(b"\x00\xD3", data)
+        frame = self.cached_frame(b"\x00\xD3", bytes([val]))
 
-        self.send_verified(
+        return (yield from self.send_verified(
             frame,
-            lambda: self.current_comfo_temp_raw == val,
+            "comfo_temp_raw",
+            lambda: self.state.comfo_temp_raw == val,
             f"Temperature {temp_c}"
-        )
+        ))
 
+    @command
     def set_pc_mode(self, nr: int):
         if nr not in [0, 1, 3, 4]:
             return
 
-        data = bytes([nr])
-        frame = self.build_frame(b"\x00\x9B", data)
+        frame = self.cached_frame(b"\x00\x9B", bytes([nr]))
 
         # Map requested mode to expected status response
         expected_mode = 2 if nr == 0 else nr
 
-        self.send_verified(
+        return (yield from self.send_verified(
             frame,
-            lambda: self.current_RS232_mode == expected_mode,
+            "rs232_mode",
+            lambda: self.state.rs232_mode == expected_mode,
             f"RS232 mode {nr}"
-        )
+        ))
         
        
+    @command
     def set_airflow_mode(self, mode: str):   
         mode = (mode or "").strip().lower()
         MAP = {
@@ -916,264 +2290,1252 @@ class CA350Client:
         if mode not in ["In", "Out", "In and Out"]:
             log.warning("Invalid airflow mode!")
             return False
+        started = time.monotonic()
         for i in range(6):
             self.press_airmode_button()
-            time.sleep(0.8)
-            if self.current_airflow_mode == mode:
+            if (yield Wait("airflow_mode", lambda: self.state.airflow_mode == mode, 0.8)):
+                self.record_verify("airflow_mode", started)
                 break
-        if self.current_airflow_mode != mode:
+        if self.state.airflow_mode != mode:
             log.warning(f"Airflow mode change failed: {mode}")
         return True
     
+    @command
     def set_auto_mode(self, target):
-        if self.auto_mode is None:
+        if self.state.auto_mode is None:
             log.warning("Mode unknown")
             return   
-        if target == "auto" and not self.auto_mode:
+        started = time.monotonic()
+        if target == "auto" and not self.state.auto_mode:
             for i in range(3):
                 self.press_clock_button_short()
-                time.sleep(0.8)
-                if self.auto_mode:
+                if (yield Wait("auto_mode", lambda: self.state.auto_mode, 0.8)):
+                    self.record_verify("auto_mode", started)
                     break
-            if not self.auto_mode:
+            if not self.state.auto_mode:
                 log.warning("Auto mode change failed")
                 return False
             return True
-        elif target == "manual" and self.auto_mode:
+        elif target == "manual" and self.state.auto_mode:
             for i in range(3):
                 self.press_clock_button_short()
-                time.sleep(0.8)
-                if self.manual_mode:
+                if (yield Wait("auto_mode", lambda: self.state.manual_mode, 0.8)):
+                    self.record_verify("auto_mode", started)
                     break
-            if not self.manual_mode:
+            if not self.state.manual_mode:
                 log.warning("Manual mode change failed")
             return True
         return False
     
     def press_airmode_button(self):
-        data = bytes([0x00, 0x06, 0x00, 0x00, 0x00, 0x00, 0x02])
-        frame = self.build_frame(b"\x00\x37", data)
-        self.sock.send(frame)
-        data = bytes([0x00, 0x0C, 0x00, 0x00, 0x00, 0x00, 0x03])
-        frame = self.build_frame(b"\x00\x37", data)
-        self.sock.send(frame)
+        press, release = self.FRAMES["airmode_short"]
+        self.write_group(press, release)
         log.debug("Sent airmode press (short)")
 
+    @command
     def reset_filter(self):
         log.info("Reset Filter...")
+        started = time.monotonic()
         for _ in range(3):
             self.press_airmode_button_long()
-            time.sleep(1)    
-            if self.filter_warn == False:
+            if (yield Wait("filter_warn", lambda: self.state.filter_warn == False, 1)):
+                self.record_verify("filter_reset", started)
                 log.info("Filter reset OK")
                 return True
         log.warning("Filter reset failed")
         return False 
         
     def press_airmode_button_long(self):
-        data = bytes([0x00, 0x80, 0x00, 0x00, 0x00, 0x00, 0x02])
-        frame = self.build_frame(b"\x00\x37", data)
-        self.sock.send(frame)
-        data = bytes([0x00, 0xC0, 0x00, 0x00, 0x00, 0x00, 0x03])
-        frame = self.build_frame(b"\x00\x37", data)
-        self.sock.send(frame)
+        press, release = self.FRAMES["airmode_long"]
+        self.write_group(press, release)
         log.debug("Sent airmode press (long)")
         
+    @command
     def set_booster(self):
         log.debug("Activating Booster") 
+        started = time.monotonic()
         for _ in range(3):
             self.press_fan_button_long()
-            time.sleep(1)    
-            if self.current_booster:
+            if (yield Wait("booster", lambda: self.state.booster, 1)):
+                self.record_verify("booster", started)
                 log.debug("Booster activated")
                 return True
         log.warning("Booster activation failed")
         return False          
             
+    @command
     def cancel_booster(self):
         log.debug("Cancelling Booster")    
+        started = time.monotonic()
         for _ in range(3):
             self.press_fan_button_short()
-            time.sleep(1)
-            if not self.current_booster:
+            if (yield Wait("booster", lambda: not self.state.booster, 1)):
+                self.record_verify("booster_cancel", started)
                 log.debug("Booster cancelled")
                 self.publish("preset_mode", "none")
-                self.current_booster = False
+                self.state.booster = False
                 return True
         log.warning("Booster cancel failed")
         return False
     
     def press_fan_button_long(self):
-        data = bytes([0x80, 0x00, 0x00, 0x00, 0x00, 0x00, 0x02])
-        frame = self.build_frame(b"\x00\x37", data)
-        self.sock.send(frame) 
-        data = bytes([0xC0, 0x00, 0x00, 0x00, 0x00, 0x00, 0x03])
-        frame = self.build_frame(b"\x00\x37", data)
-        self.sock.send(frame)  
+        press, release = self.FRAMES["fan_long"]
+        self.write_group(press, release)
         log.debug("Sent fan button press (long)")
         
     def press_fan_button_short(self):
-        data = bytes([0x06, 0x00, 0x00, 0x00, 0x00, 0x00, 0x02])
-        frame = self.build_frame(b"\x00\x37", data)
-        self.sock.send(frame) 
-        data = bytes([0x0C, 0x00, 0x00, 0x00, 0x00, 0x00, 0x03])
-        frame = self.build_frame(b"\x00\x37", data)
-        self.sock.send(frame)  
+        press, release = self.FRAMES["fan_short"]
+        self.write_group(press, release)
         log.debug("Sent fan button press (short)")
 
     def press_clock_button_short(self):
-        data = bytes([0x00, 0x00, 0x06, 0x00, 0x00, 0x00, 0x02])
-        frame = self.build_frame(b"\x00\x37", data)
-        self.sock.send(frame) 
-        data = bytes([0x00, 0x00, 0x0C, 0x00, 0x00, 0x00, 0x03])
-        frame = self.build_frame(b"\x00\x37", data)
-        self.sock.send(frame)  
+        press, release = self.FRAMES["clock_short"]
+        self.write_group(press, release)
         log.debug("Sent clock button press (short)")
         
     def get_delay_times(self):
-        frame = self.build_frame(b"\x00\xC9", b"")
-        self.sock.send(frame)
+        self.write(self.FRAMES["delay_times_request"])
         log.debug("Requested delay times")
         
     def get_operating_hours(self):
-        frame = self.build_frame(b"\x00\xDD", b"")
-        self.sock.send(frame)
+        self.write(self.FRAMES["operating_hours_request"])
+
+    @command
+    def read_state(self):
+        # all requests in one segment, done once every response has been decoded
+        # (at startup also the display frame, it comes on its own); retries ask
+        # only for the responses still missing
+        requests = self.FRAMES["state_requests"]
+        self.awaiting = set(requests)
+        try:
+            for attempt in range(1, 4):
+                if self.awaiting:
+                    self.write_group(*(requests[cmd] for cmd in tuple(self.awaiting)))
+                if (yield Wait("state", lambda: not self.awaiting and not self.unseen, 2.0)):
+                    return True
+            names = ", ".join(sorted(DECODERS[cmd].name for cmd in self.awaiting | self.unseen))
+            log.warning(f"{self.unit.label}: no full state after 3 requests, missing {names}")
+            return False
+        finally:
+            self.awaiting = set()
         
+    def read_delay_values(self):
+        # 0xCB writes all delay times at once: build it from the unit's values,
+        # not from a snapshot that may be stale. Use with "yield from"
+        if self.delays_live:
+            return True
+        self.get_delay_times()
+        if (yield Wait("delay_values", lambda: self.delays_live, 4.0)):
+            return True
+        log.warning(f"{self.unit.label}: delay times not received, not written")
+        return False
+
+    @command
     def set_booster_time(self, minutes):
-        if self.delay_values is None:
-            log.warning("Delay values unknown, requesting first")
-            self.get_delay_times()
+        if not (yield from self.read_delay_values()):
             return False
-        vals = list(self.delay_values)
+        vals = list(self.state.delay_values)
         vals[3] = int(minutes)  
         data = bytes(vals) 
         frame = self.build_frame(b"\x00\xCB", data) 
+        started = time.monotonic()
         for _ in range(3):
-            self.sock.send(frame)
-            time.sleep(0.5) 
+            self.write(frame)
             self.get_delay_times()
-            time.sleep(0.5) 
-            if self.current_booster_time == minutes:
+            if (yield Wait("delay_values", lambda: self.state.booster_time == minutes, 1)):
+                self.record_verify("booster_time", started)
                 log.debug(f"Set booster time = {minutes} min")
                 return True
         log.warning("Set booster time failed")
         return False
     
+    @command
     def set_filter_time(self, weeks):
-        if self.delay_values is None:
-            log.warning("Delay values unknown, requesting first")
-            self.get_delay_times()
-            return False  
+        if not (yield from self.read_delay_values()):
+            return False
         if weeks < 10 or weeks > 26:
             log.warning(f"Invalid filter time: {weeks}")
             return False  
-        vals = list(self.delay_values) 
+        vals = list(self.state.delay_values) 
         vals[4] = int(weeks)   
         data = bytes(vals)
         frame = self.build_frame(b"\x00\xCB", data)   
+        started = time.monotonic()
         for _ in range(3):
-            self.sock.send(frame)
-            time.sleep(0.5)   
+            self.write(frame)
             self.get_delay_times()
-            time.sleep(0.5)   
-            if self.current_filter_time == vals[4]:
+            if (yield Wait("delay_values", lambda: self.state.filter_time == vals[4], 1)):
+                self.record_verify("filter_time", started)
                 log.info(f"Set filter time = {weeks} weeks")
                 return True  
         log.warning("Set filter time failed")
         return False
     
+    # ---------- POLL CADENCE ----------
+
+    def poll_burst(self):
+        # a command wrote and waits for a state frame: poll fast for a while
+        self.poll_burst_until = time.monotonic() + POLL_BURST_WINDOW
+        if self.scheduler:
+            self.scheduler.run_soon(f"{self.unit.id}:poll")
+
+    def poll_interval(self):
+        if time.monotonic() < self.poll_burst_until:
+            return POLL_BURST_INTERVAL
+        return POLL_IDLE_INTERVAL
+
+    def poll(self):
+        self.write_group(self.FRAMES["status_poll"], self.next_button_stat())
+        log.debug("Send status poll and button status")
+
     def send_status_poll(self):
-        frame = self.build_frame(b"\x00\x33", b"")
-        self.sock.send(frame)
+        self.write(self.FRAMES["status_poll"])
         log.debug("Send status poll")
         
     def send_ccease_stat(self):
-        data = bytes([0x04, 0x13, 0x28, 0x5b, 0x05])
-        frame = self.build_frame(b"\x00\x35", data)
-        self.sock.send(frame) 
+        self.write(self.FRAMES["ccease_stat"])
         log.debug("Send CC Ease status")
     
     def send_button_stat(self):
-        data = bytes([0x00,0x00,0x00,0x00,0x00,0x00,self.button_state])
-        frame = self.build_frame(b"\x00\x37", data)
-        self.sock.send(frame)
-        # toggle 02 / 03
-        self.button_state = 0x03 if self.button_state == 0x02 else 0x02  
+        self.write(self.next_button_stat())
         log.debug("Send button status")
+
+    def next_button_stat(self):
+        frame = self.FRAMES["button_stat"][self.button_state]
+        # toggle 02 / 03
+        self.button_state = 0x03 if self.button_state == 0x02 else 0x02
+        return frame
         
     def send_ack(self):
-        self.sock.send(b"\x07\xF3")
+        self.write(self.FRAMES["ack"], urgent=True)
         log.debug("Sent ACK (07 F3)")
         
+    def log_tx_stats(self):
+        tx = self.tx
+        if tx.frames:
+            log.info(f"TX: {tx.frames} frames in {tx.segments} segments, {tx.saved()} saved by batching")
+
     def print_seen_commands(self):
         log.debug("Seen protocol commands:")
-        for c in sorted(self.seen_commands):
+        for c in sorted(self.rx_frames):
             log.debug(f"  CMD {' '.join(f'{b:02X}' for b in c)}")
 
+# ---------- FRAME TABLE ----------
+# constant frames, built once at load so polls, ACKs and button presses
+# only hand prebuilt bytes to the socket
+
+def button_frames(press, release):
+    return (
+        CA350Client.build_frame(b"\x00\x37", bytes(press)),
+        CA350Client.build_frame(b"\x00\x37", bytes(release)),
+    )
+
+CA350Client.FRAMES = types.MappingProxyType({
+    "ack": b"\x07\xF3",
+    "status_poll": CA350Client.build_frame(b"\x00\x33"),
+    "ccease_stat": CA350Client.build_frame(b"\x00\x35", bytes([0x04, 0x13, 0x28, 0x5b, 0x05])),
+    "button_stat": types.MappingProxyType({
+        state: CA350Client.build_frame(b"\x00\x37", bytes([0x00, 0x00, 0x00, 0x00, 0x00, 0x00, state]))
+        for state in (0x02, 0x03)
+    }),
+    "delay_times_request": CA350Client.build_frame(b"\x00\xC9"),
+    "operating_hours_request": CA350Client.build_frame(b"\x00\xDD"),
+    # status frame -> the request the unit answers with it, read at every connect
+    "state_requests": types.MappingProxyType({
+        b"\x00\xCE": CA350Client.build_frame(b"\x00\xCD"),
+        b"\x00\xD2": CA350Client.build_frame(b"\x00\xD1"),
+        b"\x00\xE0": CA350Client.build_frame(b"\x00\xDF"),
+        b"\x00\xE2": CA350Client.build_frame(b"\x00\xE1"),
+        b"\x00\xCA": CA350Client.build_frame(b"\x00\xC9"),
+        b"\x00\xDE": CA350Client.build_frame(b"\x00\xDD"),
+    }),
+    "airmode_short": button_frames(
+        [0x00, 0x06, 0x00, 0x00, 0x00, 0x00, 0x02],
+        [0x00, 0x0C, 0x00, 0x00, 0x00, 0x00, 0x03],
+    ),
+    "airmode_long": button_frames(
+        [0x00, 0x80, 0x00, 0x00, 0x00, 0x00, 0x02],
+        [0x00, 0xC0, 0x00, 0x00, 0x00, 0x00, 0x03],
+    ),
+    "fan_long": button_frames(
+        [0x80, 0x00, 0x00, 0x00, 0x00, 0x00, 0x02],
+        [0xC0, 0x00, 0x00, 0x00, 0x00, 0x00, 0x03],
+    ),
+    "fan_short": button_frames(
+        [0x06, 0x00, 0x00, 0x00, 0x00, 0x00, 0x02],
+        [0x0C, 0x00, 0x00, 0x00, 0x00, 0x00, 0x03],
+    ),
+    "clock_short": button_frames(
+        [0x00, 0x00, 0x06, 0x00, 0x00, 0x00, 0x02],
+        [0x00, 0x00, 0x0C, 0x00, 0x00, 0x00, 0x03],
+    ),
+})
+
+# warm the cache for every fan level, pc mode and settable temperature
+for value in (1, 2, 3, 4):
+    CA350Client.cached_frame(b"\x00\x99", bytes([value]))
+for value in (0, 1, 3, 4):
+    CA350Client.cached_frame(b"\x00\x9B", bytes([value]))
+for value in range(15 * 2 + 40, 27 * 2 + 40 + 1):
+    CA350Client.cached_frame(b"\x00\xD3", bytes([value]))
+
+# ================== FRAME DECODERS ==================
+
+class FrameDecoder:
+    """Layout of one status frame.
+
+    layout is a struct format covering the bytes the frame must at least
+    have, fields maps unpacked values to status topics as
+    (value index, status key, lookup table or converter). hook updates
+    DeviceState and publishes values derived from more than one byte,
+    notify names the state fields waiting commands are woken for, group
+    the JSON state topic the fields go to with json_state. persist keeps
+    the frame in the state snapshot.
+    """
+
+    __slots__ = ("name", "unpack", "size", "fields", "hook", "notify", "group", "persist")
+
+    def __init__(self, name, layout, fields, hook=None, notify=(), group=None, persist=False):
+        layout = struct.Struct(layout)
+        self.name = name
+        self.unpack = layout.unpack_from
+        self.size = layout.size
+        self.fields = tuple(
+            (index, key, table.__getitem__ if isinstance(table, tuple) else table)
+            for index, key, table in fields
+        )
+        self.hook = hook
+        self.notify = notify
+        self.group = group
+        self.persist = persist
+
+# lookup tables, payload by raw byte
+U8 = tuple(str(v) for v in range(256))
+TEMP = tuple(str(round((v / 2) - 20, 1)) for v in range(256))
+ON_IF_ONE = tuple("ON" if v == 1 else "OFF" for v in range(256))
+ON_IF_SET = tuple("ON" if v else "OFF" for v in range(256))
+FAN_MODE = tuple({1: "off", 2: "low", 3: "medium"}.get(v, "high") for v in range(256))
+FLAP = tuple({0: "closed", 1: "open", 2: "unknown"}.get(v, str(v)) for v in range(256))
+AIRFLOW = tuple(
+    {0x40: "In", 0x80: "Out", 0xC0: "In and Out"}.get(v & 0xC0, "unknown") for v in range(256)
+)
+BOOSTER_PRESET = tuple("boost" if v & 0x78 == 0x78 else "none" for v in range(256))
+BOOSTER_BIN = tuple("ON" if v & 0x78 == 0x78 else "OFF" for v in range(256))
+FILTER_BIN = tuple("ON" if v & 0x20 else "OFF" for v in range(256))
+VENTILATION_MODE = tuple("AUTO" if v & 0x08 else "MANUAL" for v in range(256))
+
+def u24(raw):
+    return str(int.from_bytes(raw, "big"))
+
+def ventilation_state(ca, v):
+    fan = v[2]
+    ca.state.fan_level = fan
+    # off = fan level 1 and booster off
+    ca.publish("hvac_mode", "off" if fan == 1 and not ca.state.booster else "fan_only")
+
+def temperature_state(ca, v):
+    ca.state.comfo_temp_raw = v[0]
+    ca.state.comfo_temp_c = (v[0] / 2) - 20
+
+def rs232_state(ca, v):
+    ca.state.rs232_mode = v[0]
+
+def display_state(ca, v):
+    flags, booster, airflow = v
+    state = ca.state
+    state.airflow_mode = AIRFLOW[airflow]
+    state.booster = booster & 0x78 == 0x78
+    state.filter_warn = bool(flags & 0x20)
+    state.auto_mode = bool(flags & 0x08)
+    state.manual_mode = bool(flags & 0x10)
+
+def delay_state(ca, v):
+    ca.state.delay_values = list(v)
+    ca.state.booster_time = v[3]
+    ca.state.filter_time = v[4]
+
+DECODERS = {
+    # Ventilation status
+    b"\x00\xCE": FrameDecoder(
+        "Ventilation", ">6x3B5x",
+        (
+            (0, "exhaust_fan", U8),
+            (1, "intake_fan", U8),
+            (2, "fan_level", U8),
+            (2, "fan_mode", FAN_MODE),
+        ),
+        ventilation_state, ("fan_level",), "fans",
+    ),
+    # Temperature status
+    b"\x00\xD2": FrameDecoder(
+        "Temperatures", ">5B4x",
+        (
+            (0, "comfort_temp", TEMP),
+            (1, "outside_temp", TEMP),
+            (2, "supply_temp", TEMP),
+            (3, "extract_temp", TEMP),
+            (4, "exhaust_temp", TEMP),
+        ),
+        temperature_state, ("comfo_temp_raw",), "temperatures",
+    ),
+    # Bypass
+    b"\x00\xE0": FrameDecoder(
+        "Bypass", ">3xB2xB",
+        (
+            (0, "bypass", U8),
+            (0, "bypass_active_bin", ON_IF_SET),
+            (1, "summer_mode_bin", ON_IF_ONE),
+        ),
+        group="heat_recovery",
+    ),
+    # RS232 mode
+    b"\x00\x9C": FrameDecoder(
+        "RS232 mode", ">B",
+        ((0, "rs232_mode", U8),),
+        rs232_state, ("rs232_mode",),
+    ),
+    # States from display commands: filter/auto flags, booster, airflow mode
+    b"\x00\x3C": FrameDecoder(
+        "Display", ">xB6xBB",
+        (
+            (2, "airflow_mode", AIRFLOW),
+            (1, "preset_mode", BOOSTER_PRESET),
+            (1, "booster_active_bin", BOOSTER_BIN),
+            (0, "filter_warning_bin", FILTER_BIN),
+            (0, "ventilation_mode", VENTILATION_MODE),
+        ),
+        display_state, ("airflow_mode", "booster", "filter_warn", "auto_mode"), "modes",
+    ),
+    # Preheater / frost protection: flap 1=open 0=closed 2=unknown
+    b"\x00\xE2": FrameDecoder(
+        "Preheater", ">3BHx",
+        (
+            (0, "preheater_flap", FLAP),
+            (1, "frost_protection_bin", ON_IF_ONE),
+            (2, "preheat_active_bin", ON_IF_ONE),
+            (3, "frost_minutes", str),
+        ),
+        group="heat_recovery",
+    ),
+    # act delay times: booster minutes, filter weeks
+    b"\x00\xCA": FrameDecoder(
+        "Delay times", ">8B",
+        (
+            (3, "booster_time", U8),
+            (4, "filter_time", U8),
+        ),
+        delay_state, ("delay_values",), "settings", persist=True,
+    ),
+    # Operating hours
+    b"\x00\xDE": FrameDecoder(
+        "Operating hours", ">3s3s3sHHHH3s",
+        (
+            (0, "hours_away", u24),
+            (1, "hours_low", u24),
+            (2, "hours_medium", u24),
+            (3, "hours_frost", str),
+            (4, "hours_preheat", str),
+            (5, "hours_bypass", str),
+            (6, "hours_filter", str),
+            (7, "hours_high", u24),
+        ),
+        group="hours", persist=True,
+    ),
+}
+
+# status key -> JSON state group; keys published by hooks belong to their frame's group
+KEY_GROUPS = {
+    key: decoder.group
+    for decoder in DECODERS.values() if decoder.group
+    for _, key, _ in decoder.fields
+}
+KEY_GROUPS["hvac_mode"] = "fans"
+# keys per group, a group's JSON is published once all are known
+GROUP_SIZES = collections.Counter(KEY_GROUPS.values())
+
+# frames making up the full state of a unit: all but the RS232 mode answer
+FULL_STATE = frozenset(cmd for cmd, decoder in DECODERS.items() if decoder.group)
+
+# ================== COMMAND EXECUTOR ==================
+
+class CommandExecutor:
+    """Bounded command queue with one worker thread.
+
+    Keeps paho's network thread free while a command waits for its
+    verification, and runs commands strictly one after another.
+    """
+
+    def __init__(self, ca):
+        self.ca = ca
+        self.queue = queue.Queue(COMMAND_QUEUE_SIZE)
+        self.worker = None
+        self.running = True
+        self.rejected = 0
+        self.max_depth = 0
+        self.wait_time = Histogram(QUEUE_WAIT_BUCKETS)
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def new_future(self):
+        return concurrent.futures.Future()
+
+    def submit(self, proc, trace):
+        future = self.new_future()
+        try:
+            self.queue.put_nowait((proc, trace, future))
+        except (queue.Full, asyncio.QueueFull):
+            self.rejected += 1
+            proc.close()
+            log.warning(f"Command queue full ({COMMAND_QUEUE_SIZE}), command dropped")
+            future.set_result(False)
+            return future
+        self.max_depth = max(self.max_depth, self.depth())
+        self.start()
+        return future
+
+    def record_wait(self, trace):
+        trace.started = time.monotonic()
+        waited = trace.started - trace.queued
+        self.wait_time.observe(waited)
+        log.debug(f"Command start after {waited * 1000:.0f} ms in queue, {self.depth()} waiting")
+
+    def start(self):
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run, name="ca350-commands", daemon=True)
+            self.worker.start()
+
+    def run(self):
+        while self.running:
+            proc, trace, future = self.queue.get()
+            if proc is None:
+                break
+            self.record_wait(trace)
+            try:
+                result = self.ca.drive(proc, trace)
+            except Exception as e:
+                log.warning(f"Command error: {e}")
+                result = False
+            self.ca.tracer.finish(trace, result)
+            future.set_result(result)
+
+    def stop(self):
+        self.running = False
+        try:
+            self.queue.put_nowait((None, None, None))
+        except queue.Full:
+            pass
+
+# ================== SCHEDULER ==================
+
+WALL_CLOCK_RECHECK = 300    # longest sleep while daily jobs exist, catches clock steps
+
+class Every:
+    """Fixed interval, phase kept across late or missed runs."""
+
+    wall = False
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def first(self, now):
+        return now + self.seconds
+
+    def next(self, deadline, now):
+        # from the planned deadline, not the run time, so runs don't drift
+        nxt = deadline + self.seconds
+        if nxt <= now:
+            nxt += ((now - nxt) // self.seconds + 1) * self.seconds
+        return nxt
+
+class Daily:
+    """Local wall-clock time of day."""
+
+    wall = True
+
+    def __init__(self, hour, minute=0, second=0):
+        self.hms = (hour, minute, second)
+
+    def first(self, now):
+        wall = time.time()
+        lt = time.localtime(wall)
+        target = time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday, *self.hms, 0, 0, -1))
+        if target <= wall + 1:
+            target = time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday + 1, *self.hms, 0, 0, -1))
+        return now + (target - wall)
+
+    def next(self, deadline, now):
+        return self.first(now)
+
+class PollCadence:
+    """CC Ease emulation polls: burst or idle interval, see CA350Client.poll_interval."""
+
+    wall = False
+
+    def __init__(self, ca):
+        self.ca = ca
+
+    def first(self, now):
+        return now
+
+    def next(self, deadline, now):
+        return max(deadline + self.ca.poll_interval(), now)
+
+class Liveness:
+    """Link watchdog of a unit: due when its link timeout can have run out."""
+
+    wall = False
+
+    def __init__(self, ca):
+        self.ca = ca
+
+    def first(self, now):
+        return now + self.ca.link_timeout
+
+    def next(self, deadline, now):
+        if not self.ca.running:
+            return now + self.ca.link_timeout
+        return now + max(self.ca.liveness_due(), 1.0)
+
+def parse_schedule(spec):
+    """Schedule from "15m", "every 2h", "30s", "daily 06:00[:ss]", None for "off"."""
+    spec = str(spec).strip().lower()
+    if spec in ("", "off", "none"):
+        return None
+    m = re.fullmatch(r"(?:every\s+)?(\d+)\s*([smh])", spec)
+    if m:
+        return Every(int(m.group(1)) * {"s": 1, "m": 60, "h": 3600}[m.group(2)])
+    m = re.fullmatch(r"(?:daily\s+)?(\d{1,2}):(\d{2})(?::(\d{2}))?", spec)
+    if m and int(m.group(1)) < 24 and int(m.group(2)) < 60:
+        return Daily(int(m.group(1)), int(m.group(2)), int(m.group(3) or 0))
+    raise ValueError(f"invalid schedule: {spec!r}")
+
+class Job:
+    __slots__ = ("name", "fn", "schedule", "deadline")
+
+    def __init__(self, name, fn, schedule):
+        self.name = name
+        self.fn = fn
+        self.schedule = schedule      # None = run once
+        self.deadline = None
+
+class Scheduler:
+    """Jobs on a heap of monotonic deadlines, the runner sleeps until the earliest.
+
+    run_soon() may be called from other threads (command worker) and wakes
+    the runner early. Daily jobs are re-planned when the wall clock steps.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.jobs = {}
+        self.seq = itertools.count()
+        self.lock = threading.Lock()
+        self.wake = self.make_event()
+        self.wall_offset = time.time() - time.monotonic()
+        self.wakeups = 0
+
+    def make_event(self):
+        return threading.Event()
+
+    def push(self, job, deadline):
+        # earlier heap entries of the job become stale, skipped when popped
+        job.deadline = deadline
+        heapq.heappush(self.heap, (deadline, next(self.seq), job))
+
+    def add(self, name, fn, schedule, first=None):
+        job = Job(name, fn, schedule)
+        with self.lock:
+            self.jobs[name] = job
+            now = time.monotonic()
+            self.push(job, schedule.first(now) if first is None else now + first)
+        self.wake.set()
+
+    def once(self, name, fn, delay):
+        job = Job(name, fn, None)
+        with self.lock:
+            self.jobs[name] = job
+            self.push(job, time.monotonic() + delay)
+        self.wake.set()
+
+    def run_soon(self, name):
+        with self.lock:
+            job = self.jobs.get(name)
+            if job is None:
+                return
+            self.push(job, time.monotonic())
+        self.wake.set()
+
+    def check_wall_clock(self, now):
+        offset = time.time() - now
+        if abs(offset - self.wall_offset) < 1:
+            return
+        log.info(f"Wall clock moved by {offset - self.wall_offset:+.0f} s, re-planning daily jobs")
+        self.wall_offset = offset
+        for job in list(self.jobs.values()):
+            if job.schedule and job.schedule.wall:
+                self.push(job, job.schedule.first(now))
+
+    def due(self):
+        now = time.monotonic()
+        jobs = []
+        with self.lock:
+            self.check_wall_clock(now)
+            heap = self.heap
+            while heap and heap[0][0] <= now:
+                deadline, _, job = heapq.heappop(heap)
+                if job.deadline != deadline or self.jobs.get(job.name) is not job:
+                    continue
+                jobs.append(job)
+                if job.schedule:
+                    self.push(job, job.schedule.next(deadline, now))
+                else:
+                    del self.jobs[job.name]
+            timeout = heap[0][0] - now if heap else WALL_CLOCK_RECHECK
+            if any(job.schedule and job.schedule.wall for job in self.jobs.values()):
+                timeout = min(timeout, WALL_CLOCK_RECHECK)
+        return jobs, max(timeout, 0)
+
+    def run_jobs(self, jobs):
+        for job in jobs:
+            try:
+                job.fn()
+            except Exception as e:
+                log.warning(f"Job {job.name} failed: {e}")
+
+    def run(self, stopped):
+        while not stopped():
+            self.wake.clear()
+            jobs, timeout = self.due()
+            self.run_jobs(jobs)
+            if not jobs:
+                self.wake.wait(timeout)
+                self.wakeups += 1
+
+def schedule_jobs(scheduler, ca):
+    """Periodic work of a unit in both runtimes: polls, watchdog, heartbeat and refresh requests."""
+
+    when_connected = ca.when_connected
+
+    def add(name, fn, schedule, first=None):
+        scheduler.add(f"{ca.unit.id}:{name}", fn, schedule, first)
+
+    ca.scheduler = scheduler
+    if not ca.unit.comfosense:
+        add("poll", when_connected(ca.poll), PollCadence(ca))
+        add("ccease_stat", when_connected(ca.send_ccease_stat), Every(CCEASE_STAT_INTERVAL), first=0)
+    add("watchdog", ca.check_liveness, Liveness(ca))
+    if PUBLISH_HEARTBEAT:
+        add("heartbeat", ca.republish_state, Every(PUBLISH_HEARTBEAT))
+
+    # read with the full state at every connect, then on their schedules
+    for name, fn, spec, default in (
+        ("operating_hours", ca.get_operating_hours, HOURS_SCHEDULE, "daily 06:00"),
+        ("delay_times", ca.get_delay_times, DELAY_TIMES_SCHEDULE, "daily 06:00:04"),
+    ):
+        try:
+            schedule = parse_schedule(spec)
+        except ValueError as e:
+            log.error(f"{name}: {e}, using {default!r}")
+            schedule = parse_schedule(default)
+        if schedule:
+            add(name, when_connected(fn), schedule)
+
+def log_units(clients):
+    for ca in clients:
+        prefix = "" if len(clients) == 1 else f"{ca.unit.label} ({ca.host}:{ca.port}, {ca.unit.topic}): "
+        log.info(f"{prefix}Comfosense connected: {ca.unit.comfosense}")
+
+def pc_modes(clients):
+    # (client, RS232 mode) to set at startup and after a reconnect, only next to a ComfoSense
+    for ca in clients:
+        if not ca.unit.comfosense or not ca.running:
+            continue
+        mode = ca.unit.pc_mode
+        if mode not in (0, 1, 4):
+            log.warning(f"Invalid PC mode: {mode}")
+            mode = 0
+        yield ca, mode
+
+def dump_all_frames(clients):
+    for ca in clients:
+        ca.dump_frames("SIGUSR1")
+
+# ================== STARTUP ==================
+
+class Startup:
+    """Milestones from start until every unit has its full state.
+
+    Both links come up concurrently and each unit reads its state as soon
+    as its gateway is connected, so milestones arrive in any order and from
+    any thread. When MQTT is connected and every unit is connected, has its
+    RS232 mode set and its state read, readiness is logged and published
+    once on <mqtt_base_topic>/diagnostics/startup with the seconds to each
+    milestone.
+    """
+
+    def __init__(self, mqtt_mgr, clients):
+        self.started = time.monotonic()
+        self.mqtt_mgr = mqtt_mgr
+        self.lock = threading.Lock()
+        self.marks = {"mqtt": {}}
+        self.missing = {("mqtt", "connected")}
+        self.ready = None
+        mqtt_mgr.startup = self
+        for ca in clients:
+            self.marks[ca.unit.id] = {}
+            self.missing |= {(ca.unit.id, "connected"), (ca.unit.id, "state")}
+            if ca.unit.comfosense:
+                self.missing.add((ca.unit.id, "pc_mode"))
+            ca.startup = self
+
+    def mark(self, link, milestone):
+        with self.lock:
+            if self.ready is not None or milestone in self.marks[link]:
+                return
+            self.marks[link][milestone] = round(time.monotonic() - self.started, 3)
+            self.missing.discard((link, milestone))
+            if self.missing:
+                return
+            self.ready = self.marks[link][milestone]
+        self.publish()
+
+    def publish(self):
+        units = {link: marks for link, marks in self.marks.items() if link != "mqtt"}
+        full = [marks["full_state"] for marks in units.values() if "full_state" in marks]
+        if len(full) == len(units):
+            log.info(f"Ready in {self.ready:.2f} s, full state after {max(full):.2f} s")
+        else:
+            log.info(f"Ready in {self.ready:.2f} s, full state missing on {len(units) - len(full)} unit(s)")
+        self.mqtt_mgr.publish("diagnostics/startup", json.dumps({
+            "ready": self.ready,
+            "mqtt": self.marks["mqtt"].get("connected"),
+            "units": units,
+        }, separators=(",", ":")), retain=True)
+
+# ================== ASYNCIO RUNTIME ==================
+
+MQTT_MISC_INTERVAL = 5   # paho keepalive housekeeping in the asyncio runtime
+
+class AsyncMqttManager(MqttManager):
+    """MqttManager driven by the event loop instead of paho's network thread."""
+
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+        self.misc_task = None
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def in_loop(self, fn, *args):
+        # paho calls the socket hooks from the executor thread doing the connect
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self.in_loop(self.loop.add_reader, sock, client.loop_read)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.in_loop(self.loop.remove_reader, sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.in_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.in_loop(self.loop.remove_writer, sock)
+
+    async def connect(self):
+        log.info("Connecting to MQTT broker...")
+        self.client.connect_async(mqtt_host, mqtt_port, 60)
+        try:
+            await self.open()
+        except Exception as e:
+            log.error(f"MQTT connect failed: {e}")
+            self.link.down()
+        self.misc_task = self.loop.create_task(self.misc_loop())
+
+    async def open(self):
+        # blocking DNS + TCP connect, keep it off the loop
+        await self.loop.run_in_executor(None, self.client.reconnect)
+
+    async def misc_loop(self):
+        while not self.shutting_down:
+            await asyncio.sleep(MQTT_MISC_INTERVAL)
+            self.client.loop_misc()
+
+    async def stop(self):
+        log.info("Stopping MQTT...")
+        try:
+            self.shutting_down = True
+            self.publish("status", "offline", retain=True)
+            await asyncio.sleep(1)
+            self.client.disconnect()
+            if self.misc_task:
+                self.misc_task.cancel()
+        except Exception as e:
+            log.warning(f"MQTT shutdown error: {e}")
+
+class CA350Protocol(asyncio.BufferedProtocol):
+    """Receives straight into the client's rx buffer, like recv_into."""
+
+    def __init__(self, ca):
+        self.ca = ca
+
+    def connection_made(self, transport):
+        self.ca.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self.ca.rx_space()
+
+    def buffer_updated(self, nbytes):
+        ca = self.ca
+        ca.rx_time = time.perf_counter()
+        ca.rx_bytes += nbytes
+        if ca.capture:
+            ca.capture.write(ca.rx_view[ca.rx_end:ca.rx_end + nbytes])
+        ca.rx_end += nbytes
+        ca.process_buffer()
+
+    def eof_received(self):
+        return False
+
+    def connection_lost(self, exc):
+        self.ca.connection_lost(exc)
+
+class AsyncCA350Client(CA350Client):
+    """CA350Client on an asyncio transport, commands run as serialized tasks."""
+
+    def __init__(self, host, port, mqtt_client, loop, unit=None):
+        self.loop = loop
+        super().__init__(host, port, mqtt_client, unit)
+        self.transport = None
+
+    async def connect(self):
+        if self.running:
+            return
+        log.info(f"Connecting to {self.unit.label}...")
+
+        try:
+            await self.open()
+        except Exception as e:
+            log.error(f"{self.unit.label} connect failed: {str(e) or type(e).__name__}")
+            self.link.down()
+
+    async def open(self):
+        transport, _ = await asyncio.wait_for(
+            self.loop.create_connection(lambda: CA350Protocol(self), self.host, self.port),
+            CONNECT_TIMEOUT,
+        )
+        tune_socket(transport.get_extra_info("socket"))
+        self.running = True
+        log.info(f"Connected to {self.unit.label}")
+        self.link_up()
+
+    def connection_lost(self, exc):
+        self.transport = None
+        if not self.running:
+            return
+        log.warning(f"{self.unit.label} connection lost: {exc or 'Socket closed'}")
+        self.running = False
+        self.link_down()
+
+    def abort(self):
+        if self.transport:
+            self.transport.abort()
+
+    def stop(self):
+        log.info(f"Stopping {self.unit.label} client...")
+        self.log_tx_stats()
+        self.shutting_down = True
+        self.running = False
+        if self.transport:
+            self.transport.close()
+        if self.capture:
+            self.capture.close()
+        if self.snapshot:
+            self.snapshot.close()
+
+    def send_bytes(self, data):
+        if self.transport is None:
+            raise ConnectionError("CA350 not connected")
+        self.transport.write(data)
+
+    def make_batcher(self):
+        return AsyncTxBatcher(self.send_bytes, TX_BATCH_WINDOW, self.loop)
+
+    def make_executor(self):
+        return AsyncCommandExecutor(self)
+
+    async def drive_async(self, proc, trace):
+        try:
+            step = next(proc)
+            while True:
+                self.tx.flush()
+                if isinstance(step, Wait):
+                    trace.waiting()
+                    self.poll_burst()
+                    ok = await self.wait_for_async(step)
+                    trace.waited(ok)
+                    step = proc.send(ok)
+                else:
+                    await asyncio.sleep(step)
+                    step = proc.send(None)
+        except StopIteration as e:
+            self.tx.flush()
+            return e.value
+
+    async def wait_for_async(self, step):
+        event = asyncio.Event()
+        waiters = self.waiters.setdefault(step.field, [])
+        waiters.append(event)
+        deadline = self.loop.time() + step.timeout
+        try:
+            while not step.check():
+                remaining = deadline - self.loop.time()
+                if remaining <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return step.check()
+                event.clear()
+            return True
+        finally:
+            waiters.remove(event)
+
+class AsyncTxBatcher(TxBatcher):
+    """TxBatcher flushed by a loop timer instead of a thread."""
+
+    def __init__(self, send, window, loop):
+        super().__init__(send, window)
+        self.loop = loop
+
+    def arm(self):
+        self.loop.call_later(self.window, self.flush_later)
+
+    def flush_later(self):
+        try:
+            self.flush()
+        except Exception as e:
+            log.debug(f"TX flush failed: {e}")
+
+class AsyncCommandExecutor(CommandExecutor):
+    """CommandExecutor with an asyncio queue and a worker task."""
+
+    def __init__(self, ca):
+        super().__init__(ca)
+        self.queue = asyncio.Queue(COMMAND_QUEUE_SIZE)
+
+    def new_future(self):
+        return self.ca.loop.create_future()
+
+    def start(self):
+        if self.worker is None:
+            self.worker = self.ca.loop.create_task(self.run())
+
+    async def run(self):
+        while self.running:
+            proc, trace, future = await self.queue.get()
+            self.record_wait(trace)
+            try:
+                result = await self.ca.drive_async(proc, trace)
+            except Exception as e:
+                log.warning(f"Command error: {e}")
+                result = False
+            self.ca.tracer.finish(trace, result)
+            future.set_result(result)
+
+    def stop(self):
+        self.running = False
+        if self.worker:
+            self.worker.cancel()
+
+class AsyncSupervisor(Supervisor):
+    """Supervisor with loop timers, attempts run as tasks."""
+
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+        self.tasks = set()
+
+    def arm(self, link, delay):
+        return self.loop.call_later(delay, self.spawn, link)
+
+    def spawn(self, link):
+        task = self.loop.create_task(self.attempt(link))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def attempt(self, link):
+        if not self.begin(link):
+            return
+        try:
+            await link.open()
+        except Exception as e:
+            self.failed(link, e)
+
+    def stop(self):
+        super().stop()
+        for task in self.tasks:
+            task.cancel()
+
+class AsyncScheduler(Scheduler):
+    """Scheduler run as a task on the event loop."""
+
+    def make_event(self):
+        return asyncio.Event()
+
+    async def run(self):
+        while True:
+            self.wake.clear()
+            jobs, timeout = self.due()
+            self.run_jobs(jobs)
+            if not jobs:
+                try:
+                    await asyncio.wait_for(self.wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeups += 1
+
+async def async_main():
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    supervisor = AsyncSupervisor(loop)
+    mqtt_mgr = AsyncMqttManager(loop)
+    supervisor.watch(mqtt_mgr.link)
+
+    # all units share the MQTT connection, the event loop and the scheduler
+    clients = [AsyncCA350Client(unit.host, unit.port, UnitMqtt(mqtt_mgr, unit), loop, unit) for unit in UNITS]
+    mqtt_mgr.clients = clients
+    Startup(mqtt_mgr, clients)
+    for ca in clients:
+        ca.load_snapshot()
+        supervisor.watch(ca.link)
+    loop.add_signal_handler(signal.SIGUSR1, dump_all_frames, clients)
+    metrics = await serve_metrics(mqtt_mgr) if METRICS_PORT else None
+
+    scheduler = AsyncScheduler()
+    for ca in clients:
+        schedule_jobs(scheduler, ca)
+    tasks = [loop.create_task(scheduler.run())]
+    try:
+        # both links at once, each unit sets its RS232 mode and reads its state when connected
+        await asyncio.gather(mqtt_mgr.connect(), *(ca.connect() for ca in clients))
+        log.info("System running (asyncio runtime)")
+        log_units(clients)
+
+        await stop.wait()
+        log.info("Stop signal received")
+
+    finally:
+        supervisor.stop()
+        for task in tasks:
+            task.cancel()
+        if metrics:
+            metrics.close()
+        for ca in clients:
+            ca.stop()
+            ca.executor.stop()
+        TRACE_FILE.close()
+        await mqtt_mgr.stop()
+        log.info("Shutdown complete")
+        for ca in clients:
+            ca.print_seen_commands()
+        log.info("~~~ Close Program ~~~")
+
+async def serve_metrics(mqtt_mgr):
+    # asyncio runtime: answer scrapes on the loop, one request per connection
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            path = request.split(b" ", 2)[1].split(b"?")[0]
+            if path in (b"/", b"/metrics"):
+                status, ctype, body = "200 OK", METRICS_CONTENT_TYPE, render_metrics(mqtt_mgr).encode()
+            else:
+                status, ctype, body = "404 Not Found", "text/plain", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+    try:
+        server = await asyncio.start_server(handle, None, METRICS_PORT)
+    except OSError as e:
+        log.error(f"Metrics endpoint disabled: {e}")
+        return None
+    log.info(f"Metrics on http://0.0.0.0:{METRICS_PORT}/metrics")
+    return server
+
 # ================== MAIN ==================
 
 def main():
+    supervisor = Supervisor()
     mqtt_mgr = MqttManager()
-    mqtt_mgr.connect()
-
-    ca = CA350Client(COMFOAIR_HOST, COMFOAIR_PORT, mqtt_mgr)
-    mqtt_mgr.ca = ca
+    supervisor.watch(mqtt_mgr.link)
+
+    # one rx and one command thread per unit, MQTT connection and scheduler shared
+    clients = [CA350Client(unit.host, unit.port, UnitMqtt(mqtt_mgr, unit), unit) for unit in UNITS]
+    mqtt_mgr.clients = clients
+    Startup(mqtt_mgr, clients)
+    for ca in clients:
+        ca.load_snapshot()
+        supervisor.watch(ca.link)
+    signal.signal(signal.SIGUSR1, lambda sig, frame: dump_all_frames(clients))
+    # the Supervisor stops the add-on with SIGTERM, shut down like on CTRL+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    metrics = start_metrics_server(mqtt_mgr) if METRICS_PORT else None
+
+    scheduler = Scheduler()
+    for ca in clients:
+        schedule_jobs(scheduler, ca)
 
     try:
-        ca.connect()
+        # both links at once, each unit sets its RS232 mode and reads its state when connected;
+        # a failed connect is retried by the supervisor
+        for link in (mqtt_mgr, *clients):
+            threading.Thread(target=link.connect, name=f"connect-{link.link.name}", daemon=True).start()
         log.info("System running (CTRL+C to exit)")
-        log.info(f"Comfosense connected: {Comfosense_connected}")
+        log_units(clients)
 
-        # set RS232 mode
-        if Comfosense_connected: 
-            if PcMode in (0, 1, 4):
-                ca.set_pc_mode(PcMode)
-            else:
-                log.warning(f"Invalid PC mode: {PcMode}")
-                ca.set_pc_mode(0)
-        
-        #get act delay times and operating hours
-        time.sleep(2)
-        ca.get_operating_hours()
-        time.sleep(2)
-        ca.get_delay_times()
-        device_info_timer = 0
-        delay_times_ran_today = False
-        while not ca.shutting_down:
-        
-            if not Comfosense_connected:       
-                ca.send_status_poll()
-                ca.send_button_stat()  
-                device_info_timer += 1
-                if device_info_timer >= 10:
-                    ca.send_ccease_stat()
-                    device_info_timer = 0
-                    
-            #get act delay_times and operating hours one time a day
-            now = time.localtime()
-            if now.tm_hour == 6 and not delay_times_ran_today:
-                ca.get_operating_hours()
-                time.sleep(2)
-                ca.get_operating_hours()
-                time.sleep(2)
-                ca.get_delay_times()
-                delay_times_ran_today = True
-                log.info("Daily delay times/operating hours request")
-            # reset flag after 6:00 hour
-            if now.tm_hour != 6:
-                delay_times_ran_today = False
-        
-            time.sleep(0.5)
+        # polls, heartbeat and refresh requests until CTRL+C
+        scheduler.run(lambda: clients[0].shutting_down)
 
     except KeyboardInterrupt:
-        log.info("CTRL+C received")
+        log.info("Stop signal received")
 
     finally:
-        ca.stop()
+        supervisor.stop()
+        if metrics:
+            metrics.shutdown()
+        for ca in clients:
+            ca.stop()
+            ca.executor.stop()
+        TRACE_FILE.close()
         mqtt_mgr.stop()
         log.info("Shutdown complete")
-        ca.print_seen_commands()
+        for ca in clients:
+            ca.print_seen_commands()
         log.info("~~~ Close Program ~~~")
 
 if __name__ == "__main__":
-    main()
+    if RUNTIME == "asyncio":
+        asyncio.run(async_main())
+    else:
+        main()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Byte stuffing and checksum: old per-byte loops (copied below) against the
+bulk bytes.replace / sum() versions in CA350Client.
+
+    python3 dev/bench_checksum.py [--cases N] [--rounds N]
+
+Before timing, both versions are compared on random data weighted towards
+0x07 runs, on every 0x07 run length up to 8 at start, middle and end of
+the data, and on every frame the bridge actually sends.
+"""
+
+import argparse
+import random
+import time
+
+from bench_common import STATUS_FRAMES, load_ca350
+
+ca350 = load_ca350()
+Client = ca350.CA350Client
+
+
+def legacy_stuff_data(data):
+    stuffed = bytearray()
+    for b in data:
+        stuffed.append(b)
+        if b == 0x07:
+            stuffed.append(0x07)
+    return bytes(stuffed)
+
+
+def legacy_calc_checksum(cmd, length, data):
+    total = sum(cmd) + length
+    skip_next_07 = False
+    for b in data:
+        if b == 0x07:
+            if skip_next_07:
+                skip_next_07 = False
+                continue
+            total += b
+            skip_next_07 = True
+        else:
+            skip_next_07 = False
+            total += b
+    total += 173
+    return total & 0xFF
+
+
+def sent_frames():
+    """(cmd, data) of every frame the bridge sends."""
+    frames = [
+        (b"\x00\x33", b""), (b"\x00\xC9", b""), (b"\x00\xDD", b""),
+        (b"\x00\x35", bytes([0x04, 0x13, 0x28, 0x5b, 0x05])),
+        (b"\x00\xCB", bytes([2, 1, 0, 60, 16, 0, 0, 0])),
+    ]
+    frames += [(b"\x00\x99", bytes([v])) for v in (1, 2, 3, 4)]
+    frames += [(b"\x00\x9B", bytes([v])) for v in (0, 1, 3, 4)]
+    frames += [(b"\x00\xD3", bytes([v])) for v in range(70, 95)]
+    for pos in range(3):
+        for press in (0x06, 0x0C, 0x80, 0xC0):
+            data = [0] * 7
+            data[pos] = press
+            data[6] = 0x02
+            frames.append((b"\x00\x37", bytes(data)))
+    frames += [(b"\x00\x37", bytes([0, 0, 0, 0, 0, 0, state])) for state in (2, 3)]
+    return frames
+
+
+def cases(count, seed=1):
+    rnd = random.Random(seed)
+    for run in range(1, 9):
+        for fill in (b"", b"\x01", b"\x01\x02\x03"):
+            yield fill + b"\x07" * run
+            yield b"\x07" * run + fill
+            yield fill + b"\x07" * run + fill
+    for _ in range(count):
+        n = rnd.randrange(0, 24)
+        yield bytes(0x07 if rnd.random() < 0.4 else rnd.randrange(256) for _ in range(n))
+
+
+def check(count):
+    checked = 0
+    datas = list(cases(count)) + [data for _, data in sent_frames() + STATUS_FRAMES]
+    for data in datas:
+        if Client.stuff_data(data) != legacy_stuff_data(data):
+            raise SystemExit(f"stuff_data differs for {data.hex(' ')}")
+        for cmd in (b"\x00\x37", b"\x00\xDE"):
+            if Client.calc_checksum(cmd, len(data), data) != legacy_calc_checksum(cmd, len(data), data):
+                raise SystemExit(f"calc_checksum differs for {data.hex(' ')}")
+        checked += 1
+    for cmd, data in sent_frames():
+        old = (Client.START + cmd + bytes([len(data)]) + legacy_stuff_data(data)
+               + bytes([legacy_calc_checksum(cmd, len(data), data)]) + Client.END)
+        if Client.build_frame(cmd, data) != old:
+            raise SystemExit(f"build_frame differs for {cmd.hex()} {data.hex(' ')}")
+    return checked
+
+
+def timed(fn, args, rounds, repeat=5):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            fn(*args)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best / rounds * 1e9
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--cases", type=int, default=20000)
+    ap.add_argument("--rounds", type=int, default=50000)
+    args = ap.parse_args()
+
+    print(f"{check(args.cases)} inputs identical, all sent frames identical")
+
+    samples = [
+        ("poll (0 B)", b"\x00\x33", b""),
+        ("fan level (1 B)", b"\x00\x99", b"\x03"),
+        ("CC Ease (5 B)", b"\x00\x35", bytes([0x04, 0x13, 0x28, 0x5b, 0x05])),
+        ("button (7 B)", b"\x00\x37", bytes([0, 0x06, 0, 0, 0, 0, 0x02])),
+        ("delays (8 B)", b"\x00\xCB", bytes([2, 1, 0, 60, 16, 0, 0, 0])),
+        ("hours rx (20 B)", b"\x00\xDE", STATUS_FRAMES[-1][1]),
+    ]
+    print(f"{'frame':<18}{'stuff old ns':>14}{'new ns':>9}{'cksum old ns':>14}{'new ns':>9}")
+    for name, cmd, data in samples:
+        so = timed(legacy_stuff_data, (data,), args.rounds)
+        sn = timed(Client.stuff_data, (data,), args.rounds)
+        co = timed(legacy_calc_checksum, (cmd, len(data), data), args.rounds)
+        cn = timed(Client.calc_checksum, (cmd, len(data), data), args.rounds)
+        print(f"{name:<18}{so:>14.0f}{sn:>9.0f}{co:>14.0f}{cn:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
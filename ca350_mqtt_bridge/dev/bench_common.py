@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Shared helpers for the dev benchmarks: load ca350.py without a Home Assistant
+environment, a stub MQTT manager and gateway-like byte streams.
+"""
+
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_OPTIONS = {
+    "debug": False,
+    "comfosense_connected": True,
+    "comfoair_host": "127.0.0.1",
+    "comfoair_port": 8899,
+    "pc_mode": 0,
+    "mqtt_base_topic": "comfoair",
+    "ha_prefix": "homeassistant",
+    "state_snapshot": False,
+}
+
+
+def load_ca350(**overrides):
+    """Import ca350.py with a temporary options file and quiet logging."""
+    if "ca350" in sys.modules:
+        return sys.modules["ca350"]
+    opts = dict(DEFAULT_OPTIONS, **overrides)
+    fd, path = tempfile.mkstemp(prefix="ca350_options_", suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump(opts, f)
+    os.environ["CA350_OPTIONS"] = path
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    import ca350
+    os.unlink(path)
+    ca350.log.setLevel(logging.ERROR)
+    return ca350
+
+
+class StubMqtt:
+    """Stands in for MqttManager, counts publish calls."""
+
+    def __init__(self):
+        self.publish_calls = 0
+        self.last = {}
+
+    def publish(self, topic, payload, retain=True):
+        self.publish_calls += 1
+        self.last[topic] = payload
+
+
+# ---------- FRAMES ----------
+
+# data of the status frames the unit sends, values as seen on a real unit
+STATUS_FRAMES = [
+    (b"\x00\xCE", bytes([15, 35, 50, 15, 35, 50, 35, 35, 2, 1, 0, 0, 0, 0])),
+    (b"\x00\xD2", bytes([82, 56, 78, 83, 60, 0x0F, 0, 0, 0])),
+    (b"\x00\xE0", bytes([0, 0, 0, 0, 0, 0, 0])),
+    (b"\x00\x3C", bytes([0, 0x08, 0, 0, 0, 0, 0, 0, 0, 0xC0])),
+    (b"\x00\xE2", bytes([1, 0, 0, 0, 0, 0])),
+    (b"\x00\x9C", bytes([2])),
+    (b"\x00\xCA", bytes([2, 1, 0, 60, 16, 0, 0, 0])),
+    (b"\x00\xDE", bytes([0, 0x07, 0x07, 0, 0x12, 0x34, 0, 0x56, 0x78,
+                         0, 5, 0, 7, 0x01, 0x07, 0x0F, 0xA0, 0, 0, 0x42])),
+]
+
+
+def status_frames(ca350):
+    return [ca350.CA350Client.build_frame(cmd, data) for cmd, data in STATUS_FRAMES]
+
+
+def make_stream(frames, count, noise=0.0, seed=1):
+    """Concatenate count frames, corrupting a share of them when noise > 0.
+
+    Corruption mimics what a flaky gateway delivers: garbage between frames,
+    truncated frames, flipped bytes and broken escape sequences.
+    """
+    rnd = random.Random(seed)
+    out = bytearray()
+    for n in range(count):
+        frame = frames[n % len(frames)]
+        if noise and rnd.random() < noise:
+            kind = rnd.randrange(4)
+            if kind == 0:
+                out += bytes(rnd.randrange(256) for _ in range(rnd.randrange(1, 40)))
+            elif kind == 1:
+                frame = frame[:rnd.randrange(2, len(frame))]
+            elif kind == 2:
+                pos = rnd.randrange(2, len(frame) - 2)
+                frame = frame[:pos] + bytes([rnd.randrange(256)]) + frame[pos + 1:]
+            else:
+                pos = rnd.randrange(5, len(frame) - 2)
+                frame = frame[:pos] + b"\x07\x55" + frame[pos:]
+        out += frame
+    return bytes(out)
+
+
+def chunked(stream, seed=1, max_chunk=256):
+    """Split a stream the way TCP reads from the gateway return it."""
+    rnd = random.Random(seed)
+    chunks = []
+    pos = 0
+    while pos < len(stream):
+        n = rnd.randrange(1, max_chunk + 1)
+        chunks.append(stream[pos:pos + n])
+        pos += n
+    return chunks
+
+
+def load_stream(path):
+    with open(path, "rb") as f:
+        return f.read()
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Decode throughput per frame type: the old if/elif decode_frame chain
+(copied below) against the DECODERS registry.
+
+    python3 dev/bench_decode.py [--rounds N]
+
+Both decoders are first checked to publish the same payloads and leave
+the same DeviceState for random frame contents.
+"""
+
+import argparse
+import random
+import time
+
+from bench_common import STATUS_FRAMES, StubMqtt, load_ca350
+
+ca350 = load_ca350()
+log = ca350.log
+
+STATE_FIELDS = [f for f in ca350.DeviceState.__slots__ if f not in (
+    "published", "publish_count", "suppressed_count")]
+
+
+class RegistryClient(ca350.CA350Client):
+
+    def __init__(self):
+        super().__init__("bench", 0, StubMqtt())
+
+
+class LegacyClient(RegistryClient):
+    """decode_frame as it was before the decoder registry."""
+
+    def decode_frame(self, cmd: bytes, data: bytes):
+        log.debug(f"RX {cmd.hex(' ')} DATA={data.hex(' ')}")
+
+        # Ventilation Status
+        if cmd == b"\x00\xCE" and len(data) >= 14:
+            
+            exhaust = data[6]
+            intake = data[7]
+            fan = data[8]
+            
+            log.debug(f"Exhaust(%) = {exhaust}")
+            log.debug(f"Intake(%) = {intake}")
+            log.debug(f"Fan = {fan}")
+
+            self.state.fan_level = fan
+
+            self.publish("fan_level", str(fan))
+            self.publish("intake_fan", str(intake))
+            self.publish("exhaust_fan", str(exhaust))
+
+            # Derive fan_mode string for HA climate
+            if fan == 1:
+                fan_mode = "off"
+            elif fan == 2:
+                fan_mode = "low"
+            elif fan == 3:
+                fan_mode = "medium"
+            else:
+                fan_mode = "high"
+
+            self.publish("fan_mode", fan_mode)
+
+            # Derive hvac_mode for HA
+            # off = fan level 1 and booster off
+            if fan == 1 and not self.state.booster:
+                mode = "off"
+            else:
+                mode = "fan_only"          
+            self.publish("hvac_mode", mode)
+            self.notify("fan_level")
+
+        # Temperature Status
+        elif cmd == b"\x00\xD2" and len(data) >= 9:
+            def temp(x): return (x / 2) - 20
+
+            comfosense_raw = data[0]
+            comfosense_c = temp(comfosense_raw)
+
+            outside = temp(data[1])
+            supply = temp(data[2])
+            extract = temp(data[3])
+            exhaust = temp(data[4])
+            
+            log.debug(f"Comfosense Temp. = {comfosense_c} °C")
+            log.debug(f"Outside Temp. = {outside} °C")
+            log.debug(f"Supply Temp. = {supply} °C")
+            log.debug(f"Extract Temp. = {extract} °C")
+            log.debug(f"Exhaust Temp. = {exhaust} °C")
+
+            self.state.comfo_temp_raw = comfosense_raw
+            self.state.comfo_temp_c = comfosense_c
+
+            self.publish("comfort_temp", str(round(comfosense_c, 1)))
+            self.publish("outside_temp", str(round(outside, 1)))
+            self.publish("supply_temp", str(round(supply, 1)))
+            self.publish("extract_temp", str(round(extract, 1)))
+            self.publish("exhaust_temp", str(round(exhaust, 1)))
+            self.notify("comfo_temp_raw")
+
+        # Bypass
+        elif cmd == b"\x00\xE0" and len(data) >= 7:
+            bypass = data[3]
+            self.publish("bypass", str(bypass))
+            self.publish("bypass_active_bin", "ON" if bypass>0 else "OFF")                                                              
+            log.debug(f"Bypass = {bypass}")
+            summer_mode= data[6]
+            self.publish("summer_mode_bin", "ON" if summer_mode==1 else "OFF")
+            log.debug(f"summer_mode= {summer_mode}")
+
+        # RS232 mode
+        elif cmd == b"\x00\x9C" and len(data) >= 1:
+            RS232_mode = data[0]
+            self.state.rs232_mode = RS232_mode
+            self.publish("rs232_mode", str(RS232_mode))
+            log.debug(f"RS232 mode = {RS232_mode}")
+            self.notify("rs232_mode")
+          
+        # States from Display commands
+        elif cmd == b"\x00\x3C" and len(data) >= 10:
+        
+            #Airflow mode
+            flags = data[9]
+            In = bool(flags & 0x40)
+            Out = bool(flags & 0x80)
+        
+            if In and Out:
+                mode = "In and Out"
+            elif In:
+                mode = "In"
+            elif Out:
+                mode = "Out"
+            else:
+                mode = "unknown"
+        
+            self.state.airflow_mode = mode
+        
+            log.debug(f"Airflow mode = {mode}")
+            self.publish("airflow_mode", mode)
+            
+            #Booster status
+            booster_active = (data[8] & 0x78) == 0x78
+            self.state.booster = booster_active
+            if booster_active:
+                self.publish("preset_mode", "boost")
+            else:
+                self.publish("preset_mode", "none")
+            self.publish("booster_active_bin", "ON" if self.state.booster else "OFF")                                                                          
+            log.debug(f"Booster = {'ON' if booster_active else 'OFF'}")
+            
+            #Filter status / fan mode status
+            flags = data[1]
+            filter_flag = bool(flags & 0x20)
+            
+            if filter_flag:
+                filter_state = "Full"
+                self.state.filter_warn = True
+            else:
+                filter_state = "OK"
+                self.state.filter_warn = False                                
+                
+            log.debug(f"Filter = {filter_state}")
+            self.publish("filter_warning_bin", "ON" if self.state.filter_warn else "OFF")
+        
+            self.state.auto_mode = bool(flags & 0x08)
+            self.state.manual_mode = bool(flags & 0x10)
+                    
+            mode = "AUTO" if self.state.auto_mode else "MANUAL"
+            self.publish("ventilation_mode", mode)
+            self.notify("airflow_mode", "booster", "filter_warn", "auto_mode")
+        # Preheater / Frost protection status
+        elif cmd == b"\x00\xE2" and len(data) >= 6:
+        
+            flap_status = data[0]   # 1=open / 0=closed / 2=unknown
+            frost_protection = data[1]   # 1=active / 0=inactive
+            preheat = data[2]    # 1=active / 0=inactive
+        
+            frost_minutes = (data[3] << 8) | data[4]   # Bytes 4-5
+        
+            flap_txt = {0: "closed", 1: "open", 2: "unknown"}.get(flap_status, str(flap_status))
+        
+            log.debug(f"Preheater flap = {flap_txt}")
+            log.debug(f"Frost protection = {'ON' if frost_protection == 1 else 'OFF'}")
+            log.debug(f"Preheater active = {'ON' if preheat == 1 else 'OFF'}")
+            log.debug(f"Frost minutes = {frost_minutes} min")
+        
+            # MQTT publish
+            self.publish("preheater_flap", flap_txt)
+            self.publish("frost_protection_bin", "ON" if frost_protection == 1 else "OFF")
+            self.publish("preheat_active_bin", "ON" if preheat == 1 else "OFF")
+            self.publish("frost_minutes", str(frost_minutes))
+
+        #act delay times
+        elif cmd == b"\x00\xCA" and len(data) >= 8:
+            self.state.delay_values = list(data[:8])    
+            booster_time = data[3]   
+            filter_time = data[4]
+            log.debug(f"Booster time = {booster_time} min")    
+            log.debug(f"Filter time = {filter_time} weeks")   
+            self.state.booster_time = booster_time   
+            self.state.filter_time = filter_time 
+            self.publish("booster_time", str(booster_time))
+            self.publish("filter_time", str(filter_time))
+            self.notify("delay_values")
+          
+        #Operating hours    
+        elif cmd == b"\x00\xDE" and len(data) >= 20:
+            def get_3byte(idx):
+                return (data[idx] << 16) | (data[idx+1] << 8) | data[idx+2]      
+            def get_2byte(idx):
+                return (data[idx] << 8) | data[idx+1]
+        
+            hours_away = get_3byte(0)
+            hours_low = get_3byte(3)
+            hours_medium = get_3byte(6)
+            hours_frost = get_2byte(9)
+            hours_preheat = get_2byte(11)
+            hours_bypass = get_2byte(13)
+            hours_filter = get_2byte(15)
+            hours_high = get_3byte(17)
+            log.debug("Operating hours received") 
+        
+            self.publish("hours_away", hours_away)
+            self.publish("hours_low", hours_low)
+            self.publish("hours_medium", hours_medium)
+            self.publish("hours_frost", hours_frost)
+            self.publish("hours_preheat", hours_preheat)
+            self.publish("hours_bypass", hours_bypass)
+            self.publish("hours_filter", hours_filter)
+            self.publish("hours_high", hours_high)
+
+
+def snapshot(client):
+    return (
+        dict(client.mqtt.last),
+        {f: getattr(client.state, f) for f in STATE_FIELDS},
+    )
+
+
+def check(rounds=2000, seed=1):
+    rnd = random.Random(seed)
+    new, old = RegistryClient(), LegacyClient()
+    for _ in range(rounds):
+        cmd, data = STATUS_FRAMES[rnd.randrange(len(STATUS_FRAMES))]
+        data = bytes(rnd.randrange(256) for _ in range(len(data)))
+        new.decode_frame(cmd, data)
+        old.decode_frame(cmd, data)
+        if snapshot(new) != snapshot(old):
+            raise SystemExit(f"decoders differ for {cmd.hex()} {data.hex()}")
+
+
+def timed(client, cmd, data, rounds):
+    decode = client.decode_frame
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        decode(cmd, data)
+    return (time.perf_counter() - t0) / rounds * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--rounds", type=int, default=50000)
+    args = ap.parse_args()
+
+    check()
+    print("registry and legacy decoder agree")
+
+    print(f"{'cmd':<8}{'legacy us':>11}{'registry us':>13}{'speedup':>9}")
+    for cmd, data in STATUS_FRAMES:
+        old = min(timed(LegacyClient(), cmd, data, args.rounds) for _ in range(3))
+        new = min(timed(RegistryClient(), cmd, data, args.rounds) for _ in range(3))
+        print(f"{cmd.hex(' '):<8}{old:>11.2f}{new:>13.2f}{old / new:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the RX -> decode -> publish hot path, MQTT stubbed out.
+
+    python3 dev/bench_hotpath.py [--frames N] [--json results.json] [stream.bin ...]
+
+For each stream (synthetic clean/noisy, plus raw gateway dumps given as
+arguments) the bytes are fed in gateway-sized chunks through
+CA350Client.process_buffer, handle_frame and decode_frame, reporting
+frames/s and publish calls per frame. Per frame type it reports us per
+frame and, via tracemalloc, the peak bytes allocated while handling one
+frame and the bytes still held afterwards.
+
+tracemalloc tracks memory, not allocation counts, so "allocations" are
+reported as peak transient bytes per frame. Results are printed and, with
+--json, written as one JSON document for comparing releases.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from bench_common import APP_DIR, STATUS_FRAMES, StubMqtt, chunked, load_ca350, load_stream, make_stream
+
+ca350 = load_ca350()
+
+# bytes that change between frames on a running unit: (frame index, byte offsets)
+MEASUREMENTS = {
+    0: (6, 7),           # 0xCE fan percentages
+    1: (1, 2, 3, 4),     # 0xD2 temperatures
+    4: (3, 4),           # 0xE2 frost minutes
+}
+
+
+class BenchClient(ca350.CA350Client):
+
+    def __init__(self):
+        super().__init__("bench", 0, StubMqtt())
+        self.frames = 0
+
+    def handle_frame(self, cmd, length, data, checksum, raw):
+        self.frames += 1
+        super().handle_frame(cmd, length, data, checksum, raw)
+
+
+def status_stream(count, change=0.3, seed=1):
+    """Frames in the unit's order with measurements drifting like on a real unit."""
+    rnd = random.Random(seed)
+    datas = [bytearray(data) for _, data in STATUS_FRAMES]
+    frames = []
+    for n in range(count):
+        idx = n % len(STATUS_FRAMES)
+        for pos in MEASUREMENTS.get(idx, ()):
+            if rnd.random() < change:
+                datas[idx][pos] = max(0, min(255, datas[idx][pos] + rnd.choice((-1, 1))))
+        frames.append(ca350.CA350Client.build_frame(STATUS_FRAMES[idx][0], bytes(datas[idx])))
+    return b"".join(frames)
+
+
+def run_stream(stream, repeat=3):
+    chunks = chunked(stream)
+    best = None
+    for _ in range(repeat):
+        client = BenchClient()
+        t0 = time.perf_counter()
+        for chunk in chunks:
+            client.feed(chunk)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return {
+        "bytes": len(stream),
+        "frames": client.frames,
+        "frames_per_s": round(client.frames / best),
+        "us_per_frame": round(best / max(client.frames, 1) * 1e6, 3),
+        "publish_calls_per_frame": round(client.mqtt.publish_calls / max(client.frames, 1), 3),
+        "suppressed_per_frame": round(client.state.suppressed_count / max(client.frames, 1), 3),
+        "checksum_errors": client.checksum_errors,
+        "resyncs": client.rx_resyncs,
+        "dropped_bytes": client.rx_dropped,
+    }
+
+
+def parsed(stream):
+    """(cmd, length, data, checksum, raw) of every frame in a stream."""
+    frames = []
+
+    class Recorder(ca350.CA350Client):
+        def handle_frame(self, cmd, length, data, checksum, raw):
+            frames.append((cmd, length, bytes(data), checksum, bytes(raw)))
+
+    Recorder("bench", 0, StubMqtt()).feed(stream)
+    return frames
+
+
+def run_frame_types(frames_per_type):
+    stream = status_stream(len(STATUS_FRAMES) * frames_per_type)
+    by_cmd = {}
+    for frame in parsed(stream):
+        by_cmd.setdefault(frame[0], []).append(frame)
+
+    results = {}
+    for cmd, frames in by_cmd.items():
+        client = BenchClient()
+        handle = client.handle_frame
+        t0 = time.perf_counter()
+        for frame in frames:
+            handle(*frame)
+        dt = time.perf_counter() - t0
+
+        client = BenchClient()
+        handle = client.handle_frame
+        tracemalloc.start()
+        base, _ = tracemalloc.get_traced_memory()
+        peak_sum = 0
+        for frame in frames:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            handle(*frame)
+            _, peak = tracemalloc.get_traced_memory()
+            peak_sum += peak - before
+        held, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[cmd.hex()] = {
+            "frames": len(frames),
+            "us_per_frame": round(dt / len(frames) * 1e6, 3),
+            "alloc_peak_bytes_per_frame": round(peak_sum / len(frames), 1),
+            "held_bytes_per_frame": round((held - base) / len(frames), 2),
+            "publish_calls_per_frame": round(client.mqtt.publish_calls / len(frames), 3),
+        }
+    return results
+
+
+def version():
+    try:
+        with open(os.path.join(os.path.dirname(APP_DIR), "VERSION")) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--frames", type=int, default=20000, help="frames per synthetic stream")
+    ap.add_argument("--json", help="write results to this file, - for stdout")
+    ap.add_argument("streams", nargs="*", help="raw gateway byte dumps")
+    args = ap.parse_args()
+
+    streams = {
+        "synthetic": status_stream(args.frames),
+        "synthetic_noisy_5pct": make_stream(
+            [raw for *_, raw in parsed(status_stream(len(STATUS_FRAMES) * 50))],
+            args.frames, noise=0.05),
+    }
+    for path in args.streams:
+        streams[os.path.basename(path)] = load_stream(path)
+
+    results = {
+        "version": version(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "streams": {name: run_stream(data) for name, data in streams.items()},
+        "frame_types": run_frame_types(max(args.frames // len(STATUS_FRAMES), 100)),
+    }
+
+    for name, r in results["streams"].items():
+        print(f"{name:<24}{r['frames']:>8} frames {r['frames_per_s']:>9} frames/s "
+              f"{r['us_per_frame']:>7.2f} us/frame {r['publish_calls_per_frame']:>5.2f} publish/frame")
+    print(f"{'cmd':<8}{'us/frame':>10}{'peak B/frame':>14}{'held B/frame':>14}{'publish/frame':>15}")
+    for cmd, r in results["frame_types"].items():
+        print(f"{cmd:<8}{r['us_per_frame']:>10.2f}{r['alloc_peak_bytes_per_frame']:>14.1f}"
+              f"{r['held_bytes_per_frame']:>14.2f}{r['publish_calls_per_frame']:>15.3f}")
+
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
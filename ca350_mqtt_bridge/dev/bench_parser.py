@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Before/after benchmark of the RX frame parser.
+
+Feeds gateway-like byte streams through the old bytearray parser (copied
+below) and through CA350Client.process_buffer and prints frames/s.
+
+    python3 dev/bench_parser.py [--frames N] [raw_stream.bin ...]
+
+Raw byte dumps of a gateway stream can be passed as extra arguments.
+"""
+
+import argparse
+import os
+import time
+
+from bench_common import StubMqtt, chunked, load_ca350, load_stream, make_stream, status_frames
+
+ca350 = load_ca350()
+
+
+class LegacyParser:
+    """process_buffer as shipped up to v1.8.3."""
+
+    START = b"\x07\xF0"
+    END = b"\x07\x0F"
+
+    def __init__(self, client):
+        self.client = client
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer.extend(data)
+        self.process_buffer()
+
+    def process_buffer(self):
+        while True:
+            start = self.buffer.find(self.START)
+            if start == -1:
+                self.buffer.clear()
+                return
+            if start > 0:
+                del self.buffer[:start]
+            if len(self.buffer) < 5:
+                return
+            cmd = bytes(self.buffer[2:4])
+            length = self.buffer[4]
+            i = 5
+            decoded = bytearray()
+            while len(decoded) < length:
+                if i >= len(self.buffer):
+                    return
+                b = self.buffer[i]
+                if b == 0x07:
+                    if i + 1 >= len(self.buffer):
+                        return
+                    nxt = self.buffer[i + 1]
+                    if nxt == 0x07:
+                        decoded.append(0x07)
+                        i += 2
+                    else:
+                        del self.buffer[0]
+                        break
+                else:
+                    decoded.append(b)
+                    i += 1
+            if i + 3 > len(self.buffer):
+                return
+            checksum = self.buffer[i]
+            end = self.buffer[i + 1:i + 3]
+            if end != self.END:
+                del self.buffer[0]
+                continue
+            raw_frame = bytes(self.buffer[:i + 3])
+            del self.buffer[:i + 3]
+            self.client.handle_frame(cmd, length, bytes(decoded), checksum, raw_frame)
+
+
+class CountingClient(ca350.CA350Client):
+    """Parser only: count frames instead of decoding them."""
+
+    def __init__(self):
+        super().__init__("bench", 0, StubMqtt())
+        self.frames = 0
+
+    def handle_frame(self, cmd, length, data, checksum, raw):
+        self.frames += 1
+
+
+def run(name, chunks, make_parser):
+    best = None
+    frames = 0
+    for _ in range(3):
+        client = CountingClient()
+        parser = make_parser(client)
+        t0 = time.perf_counter()
+        for chunk in chunks:
+            parser.feed(chunk)
+        dt = time.perf_counter() - t0
+        frames = client.frames
+        best = dt if best is None else min(best, dt)
+    return frames, best
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--frames", type=int, default=20000)
+    ap.add_argument("--chunk", type=int, default=256, help="max bytes per read")
+    ap.add_argument("streams", nargs="*", help="raw gateway byte dumps")
+    args = ap.parse_args()
+
+    frames = status_frames(ca350)
+    streams = [
+        ("clean", make_stream(frames, args.frames)),
+        ("noisy 5%", make_stream(frames, args.frames, noise=0.05)),
+        ("noisy 30%", make_stream(frames, args.frames, noise=0.30)),
+    ]
+    for path in args.streams:
+        streams.append((os.path.basename(path), load_stream(path)))
+
+    print(f"{'stream':<16}{'parser':<10}{'frames':>8}{'frames/s':>12}{'speedup':>9}")
+    for name, stream in streams:
+        chunks = chunked(stream, max_chunk=args.chunk)
+        n_old, t_old = run(name, chunks, LegacyParser)
+        n_new, t_new = run(name, chunks, lambda c: c)
+        print(f"{name:<16}{'legacy':<10}{n_old:>8}{n_old / t_old:>12.0f}")
+        print(f"{'':<16}{'ring':<10}{n_new:>8}{n_new / t_new:>12.0f}{t_old / t_new:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Startup benchmark against dev/ca350_sim.py: time from start to the first
+full state of every unit, MQTT stubbed out (its connect counts as instant).
+
+    python3 dev/bench_startup.py [--units 1,4] [--runtime threads,asyncio] [--mode serial,concurrent] [--repeat 3] [--json results.json]
+
+concurrent is the bridge's startup: gateways connected at once, each unit
+sets its RS232 mode and sends all status requests in one write as soon
+as it is connected, readiness once every frame has been decoded. serial
+replays the previous sequence for comparison: units connected one after
+another, RS232 mode verified, operating hours requested 2 s and delay
+times 4 s later, the rest left to the unit's periodic frames.
+Reported per mode (median over --repeat runs): seconds until all units
+are connected, until every unit has its full state and until readiness.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from bench_common import StubMqtt, load_ca350
+
+DEV_DIR = os.path.dirname(os.path.abspath(__file__))
+TIMEOUT = 20.0
+
+
+def unit_options(count, port, comfosense):
+    return {
+        "comfosense_connected": comfosense,
+        "comfoair_port": port,
+        "units": [
+            {"name": f"unit {n}", "comfoair_host": "127.0.0.1", "comfoair_port": port + n}
+            for n in range(1, count)
+        ],
+    }
+
+
+def done(startup, clients, mode):
+    if any(ca.unseen for ca in clients):
+        return False
+    return mode == "serial" or startup.ready is not None
+
+
+def results(startup, clients):
+    marks = [startup.marks[ca.unit.id] for ca in clients]
+
+    def last(milestone):
+        times = [m.get(milestone) for m in marks]
+        return None if None in times else max(times)
+
+    return {
+        "units": len(clients),
+        "connected_s": last("connected"),
+        "full_state_s": last("full_state"),
+        "ready_s": startup.ready,
+        "tx_frames": sum(ca.tx.frames for ca in clients),
+        "tx_segments": sum(ca.tx.segments for ca in clients),
+    }
+
+
+def setup(ca350, clients, scheduler, mode):
+    startup = ca350.Startup(StubMqtt(), clients)
+    startup.mark("mqtt", "connected")
+    for ca in clients:
+        ca350.schedule_jobs(scheduler, ca)
+        if mode == "serial":
+            ca.restore = lambda: None     # the previous startup read nothing at connect
+    return startup
+
+
+def serial_threads(ca350, clients):
+    for ca in clients:
+        ca.connect()
+    for future in [ca.set_pc_mode(mode) for ca, mode in ca350.pc_modes(clients)]:
+        future.result()
+    time.sleep(2)
+    for ca in clients:
+        ca.get_operating_hours()
+    time.sleep(2)
+    for ca in clients:
+        ca.get_delay_times()
+
+
+def child_threads(ca350, mode):
+    clients = [ca350.CA350Client(unit.host, unit.port, StubMqtt(), unit) for unit in ca350.UNITS]
+    scheduler = ca350.Scheduler()
+    startup = setup(ca350, clients, scheduler, mode)
+    stopped = threading.Event()
+    threading.Thread(target=scheduler.run, args=(stopped.is_set,), daemon=True).start()
+
+    if mode == "serial":
+        serial_threads(ca350, clients)
+    else:
+        for ca in clients:
+            threading.Thread(target=ca.connect, daemon=True).start()
+    deadline = time.monotonic() + TIMEOUT
+    while not done(startup, clients, mode) and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+    stopped.set()
+    scheduler.wake.set()
+    out = results(startup, clients)
+    for ca in clients:
+        ca.stop()
+        ca.executor.stop()
+    return out
+
+
+async def serial_asyncio(ca350, clients, loop):
+    await asyncio.gather(*(ca.connect() for ca in clients))
+    for delay, request in ((2, "get_operating_hours"), (4, "get_delay_times")):
+        for ca in clients:
+            loop.call_later(delay, getattr(ca, request))
+    await asyncio.gather(*(ca.set_pc_mode(mode) for ca, mode in ca350.pc_modes(clients)))
+
+
+async def child_asyncio(ca350, mode):
+    loop = asyncio.get_running_loop()
+    clients = [ca350.AsyncCA350Client(unit.host, unit.port, StubMqtt(), loop, unit) for unit in ca350.UNITS]
+    scheduler = ca350.AsyncScheduler()
+    startup = setup(ca350, clients, scheduler, mode)
+    runner = loop.create_task(scheduler.run())
+
+    if mode == "serial":
+        await serial_asyncio(ca350, clients, loop)
+    else:
+        await asyncio.gather(*(ca.connect() for ca in clients))
+    deadline = time.monotonic() + TIMEOUT
+    while not done(startup, clients, mode) and time.monotonic() < deadline:
+        await asyncio.sleep(0.005)
+
+    runner.cancel()
+    out = results(startup, clients)
+    for ca in clients:
+        ca.stop()
+        ca.executor.stop()
+    return out
+
+
+def child(args):
+    ca350 = load_ca350(runtime=args.child, **unit_options(args.count, args.port, args.comfosense))
+    if args.child == "asyncio":
+        out = asyncio.run(child_asyncio(ca350, args.mode))
+    else:
+        out = child_threads(ca350, args.mode)
+    print(json.dumps(out))
+
+
+def run(count, runtime, mode, args):
+    # a fresh simulator per run, its periodic frames start with the connection
+    sim = subprocess.Popen(
+        [sys.executable, os.path.join(DEV_DIR, "ca350_sim.py"), "--port", str(args.port),
+         "--units", str(count)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        time.sleep(1)
+        cmd = [sys.executable, __file__, "--child", runtime, "--mode", mode, "--count", str(count),
+               "--port", str(args.port)]
+        if args.comfosense:
+            cmd.append("--comfosense")
+        out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+        return json.loads(out.strip().splitlines()[-1])
+    finally:
+        sim.terminate()
+        sim.wait()
+
+
+def median(runs, key):
+    values = [r[key] for r in runs]
+    return None if None in values else round(statistics.median(values), 3)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--units", default="1,4", help="unit counts to run")
+    ap.add_argument("--runtime", default="threads,asyncio")
+    ap.add_argument("--mode", default="serial,concurrent")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--port", type=int, default=18970, help="first simulator port")
+    ap.add_argument("--comfosense", action="store_true", help="listen only, no polls and ACKs")
+    ap.add_argument("--json", help="write results to this file, - for stdout")
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    ap.add_argument("--count", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    def fmt(value):
+        return f"{value:>10.3f}" if value is not None else f"{'-':>10}"
+
+    rows = []
+    print(f"{'runtime':<9}{'mode':<12}{'units':>6}{'connected':>10}{'full state':>11}{'ready':>10}{'tx seg':>8}")
+    for runtime in args.runtime.split(","):
+        for count in (int(n) for n in args.units.split(",")):
+            for mode in args.mode.split(","):
+                runs = [run(count, runtime, mode, args) for _ in range(args.repeat)]
+                r = {
+                    "runtime": runtime, "mode": mode, "units": count,
+                    **{key: median(runs, key) for key in ("connected_s", "full_state_s", "ready_s")},
+                    "tx_segments": runs[-1]["tx_segments"],
+                    "runs": runs,
+                }
+                rows.append(r)
+                print(f"{runtime:<9}{mode:<12}{count:>6}{fmt(r['connected_s'])} {fmt(r['full_state_s'])}"
+                      f"{fmt(r['ready_s'])}{r['tx_segments']:>8}", flush=True)
+
+    if args.json == "-":
+        json.dump(rows, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Scaling benchmark of the multi-unit bridge against dev/ca350_sim.py,
+MQTT stubbed out.
+
+    python3 dev/bench_units.py [--units 1,4,16] [--runtime threads,asyncio] [--seconds 20] [--json results.json]
+
+For every unit count the simulator is started with --units N, then the
+bridge clients run in a child process (ca350.py reads its units at import)
+with one fan level command per unit and second. Reported per run: CPU
+time per wall second, peak RSS, threads, frames and publishes per second,
+command latency (queueing to confirming frame), scheduler wakeups and
+TX segments saved by batching.
+CC Ease emulation (polls and ACKs) is used unless --comfosense is given.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+from bench_common import StubMqtt, load_ca350
+
+DEV_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def unit_options(count, port, comfosense, tx_batch_ms):
+    return {
+        "comfosense_connected": comfosense,
+        "tx_batch_ms": tx_batch_ms,
+        "comfoair_port": port,
+        "units": [
+            {"name": f"unit {n}", "comfoair_host": "127.0.0.1", "comfoair_port": port + n}
+            for n in range(1, count)
+        ],
+    }
+
+
+def commands(clients, seconds, submit):
+    """One fan level change per unit and second, levels 2 and 3 alternating."""
+    for tick in range(int(seconds)):
+        for ca in clients:
+            submit(ca, 2 + (tick % 2))
+        yield 1.0
+
+
+def results(clients, scheduler, wall, cpu):
+    count = failed = total = 0
+    for ca in clients:
+        for hist, _, fails, _ in ca.tracer.stats.values():
+            count += hist.count
+            failed += fails
+            total += hist.sum
+    frames = sum(sum(ca.rx_frames.values()) for ca in clients)
+    return {
+        "units": len(clients),
+        "connected": sum(ca.running for ca in clients),
+        "cpu_per_s": round(cpu / wall, 4),
+        "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "threads": threading.active_count(),
+        "frames_per_s": round(frames / wall, 1),
+        "publishes_per_s": round(sum(ca.mqtt.publish_calls for ca in clients) / wall, 1),
+        "commands": count,
+        "command_avg_ms": round(total / count * 1000, 1) if count else None,
+        "commands_failed": failed,
+        "tx_segments_saved_per_s": round(sum(ca.tx.saved() for ca in clients) / wall, 1),
+        "scheduler_wakeups_per_s": round(scheduler.wakeups / wall, 1),
+        "checksum_errors": sum(ca.checksum_errors for ca in clients),
+    }
+
+
+def child_threads(ca350, seconds):
+    clients = [ca350.CA350Client(unit.host, unit.port, StubMqtt(), unit) for unit in ca350.UNITS]
+    for ca in clients:
+        ca.connect()
+    scheduler = ca350.Scheduler()
+    for ca in clients:
+        ca350.schedule_jobs(scheduler, ca)
+    stopped = threading.Event()
+    runner = threading.Thread(target=scheduler.run, args=(stopped.is_set,), daemon=True)
+
+    wall0, cpu0 = time.monotonic(), time.process_time()
+    runner.start()
+    for delay in commands(clients, seconds, lambda ca, level: ca.set_fan_level(level)):
+        time.sleep(delay)
+    wall, cpu = time.monotonic() - wall0, time.process_time() - cpu0
+    stopped.set()
+    scheduler.wake.set()
+    out = results(clients, scheduler, wall, cpu)
+    for ca in clients:
+        ca.stop()
+        ca.executor.stop()
+    return out
+
+
+async def child_asyncio(ca350, seconds):
+    loop = asyncio.get_running_loop()
+    clients = [ca350.AsyncCA350Client(unit.host, unit.port, StubMqtt(), loop, unit) for unit in ca350.UNITS]
+    await asyncio.gather(*(ca.connect() for ca in clients))
+    scheduler = ca350.AsyncScheduler()
+    for ca in clients:
+        ca350.schedule_jobs(scheduler, ca)
+
+    wall0, cpu0 = time.monotonic(), time.process_time()
+    runner = loop.create_task(scheduler.run())
+    for delay in commands(clients, seconds, lambda ca, level: ca.set_fan_level(level)):
+        await asyncio.sleep(delay)
+    wall, cpu = time.monotonic() - wall0, time.process_time() - cpu0
+    runner.cancel()
+    out = results(clients, scheduler, wall, cpu)
+    for ca in clients:
+        ca.stop()
+        ca.executor.stop()
+    return out
+
+
+def child(args):
+    ca350 = load_ca350(runtime=args.child, **unit_options(args.count, args.port, args.comfosense, args.tx_batch_ms))
+    if args.child == "asyncio":
+        out = asyncio.run(child_asyncio(ca350, args.seconds))
+    else:
+        out = child_threads(ca350, args.seconds)
+    print(json.dumps(out))
+
+
+def run(count, runtime, args):
+    sim = subprocess.Popen(
+        [sys.executable, os.path.join(DEV_DIR, "ca350_sim.py"), "--port", str(args.port),
+         "--units", str(count), "--speed", str(args.speed)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        time.sleep(1)
+        cmd = [sys.executable, __file__, "--child", runtime, "--count", str(count),
+               "--port", str(args.port), "--seconds", str(args.seconds), "--tx-batch-ms", str(args.tx_batch_ms)]
+        if args.comfosense:
+            cmd.append("--comfosense")
+        out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+        return json.loads(out.strip().splitlines()[-1])
+    finally:
+        sim.terminate()
+        sim.wait()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--units", default="1,4,16", help="unit counts to run")
+    ap.add_argument("--runtime", default="threads,asyncio")
+    ap.add_argument("--seconds", type=float, default=20)
+    ap.add_argument("--speed", type=float, default=1.0, help="simulator frame rate multiplier")
+    ap.add_argument("--port", type=int, default=18950, help="first simulator port")
+    ap.add_argument("--comfosense", action="store_true", help="listen only, no polls and ACKs")
+    ap.add_argument("--tx-batch-ms", type=float, default=5, help="bridge option tx_batch_ms, 0 = off")
+    ap.add_argument("--json", help="write results to this file, - for stdout")
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    ap.add_argument("--count", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    runs = []
+    print(f"{'runtime':<9}{'units':>6}{'conn':>6}{'cpu/s':>8}{'rss MB':>8}{'threads':>8}"
+          f"{'frames/s':>10}{'pub/s':>8}{'cmds':>6}{'cmd ms':>8}{'wakeups/s':>11}{'tx saved/s':>12}")
+    for runtime in args.runtime.split(","):
+        for count in (int(n) for n in args.units.split(",")):
+            r = dict(run(count, runtime, args), runtime=runtime)
+            runs.append(r)
+            print(f"{runtime:<9}{r['units']:>6}{r['connected']:>6}{r['cpu_per_s']:>8.3f}{r['rss_mb']:>8.1f}"
+                  f"{r['threads']:>8}{r['frames_per_s']:>10.1f}{r['publishes_per_s']:>8.1f}{r['commands']:>6}"
+                  f"{r['command_avg_ms'] or 0:>8.1f}{r['scheduler_wakeups_per_s']:>11.1f}"
+                  f"{r['tx_segments_saved_per_s']:>12.1f}", flush=True)
+
+    if args.json == "-":
+        json.dump(runs, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(runs, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
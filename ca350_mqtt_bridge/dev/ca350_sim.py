@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+ComfoAir 350 simulator speaking the RS232 frame protocol on a TCP port,
+standing in for the unit behind the Waveshare gateway.
+
+    python3 dev/ca350_sim.py [--port 8899] [--units 4] [--speed 10] [--checksum-errors 0.01] ...
+
+Status frames (0xCE, 0xD2, 0xE0, 0x3C, 0xE2 and optionally 0xCA, 0xDE)
+are sent periodically, --speed multiplies every rate. Commands from the
+bridge are applied to the simulated unit and confirmed like the real one
+does: 0x99 fan level, 0xD3 comfort temperature, 0x9B RS232 mode, 0xCB
+delay times, 0xCD/0xD1/0xDF/0xE1/0xC9/0xDD requests, 0x33 poll and 0x37
+button presses
+(fan long = booster, fan short = cancel booster, airmode short = next
+airflow mode, airmode long = filter reset, clock short = auto/manual).
+
+Faults can be injected: checksum errors, broken escape sequences, stalls
+(no bytes sent for a while) and disconnects. The time from each command
+to the frame confirming it is reported on exit and with --stats.
+
+--units N simulates N units on the ports --port ... --port + N - 1 for
+the bridge's multi-unit setup, statistics are summed over all units.
+"""
+
+import argparse
+import asyncio
+import random
+import signal
+import time
+
+from bench_common import load_ca350
+
+ca350 = load_ca350()
+build_frame = ca350.CA350Client.build_frame
+
+# seconds between frames at --speed 1, 0 = only on request
+PERIODS = {
+    "ce": 1.0,
+    "d2": 1.0,
+    "3c": 1.0,
+    "e0": 5.0,
+    "e2": 5.0,
+    "ca": 0.0,
+    "de": 0.0,
+}
+
+AIRFLOW_CYCLE = (0xC0, 0x40, 0x80)   # In and Out -> In -> Out
+
+# status requests: command -> (name, frame sent in reply)
+REQUESTS = {
+    b"\x00\xCD": ("get_fans", "ce"),
+    b"\x00\xD1": ("get_temps", "d2"),
+    b"\x00\xDF": ("get_bypass", "e0"),
+    b"\x00\xE1": ("get_preheater", "e2"),
+}
+
+
+class Unit:
+    """State of the simulated ventilation unit, shared by all connections."""
+
+    def __init__(self):
+        self.fan_level = 2
+        self.fan_percent = {1: 15, 2: 35, 3: 50, 4: 70}
+        self.comfort_raw = 82            # 21.0 C
+        self.temps = [56, 78, 83, 60]    # outside, supply, extract, exhaust
+        self.rs232_mode = 2
+        self.airflow = 0xC0
+        self.booster = False
+        self.filter_full = False
+        self.auto_mode = False
+        self.bypass = 0
+        self.delays = [2, 1, 0, 60, 16, 0, 0, 0]
+        self.hours = [1200, 34000, 5600, 40, 120, 800, 2100, 900]
+
+    def drift(self, rnd):
+        i = rnd.randrange(len(self.temps))
+        self.temps[i] = max(0, min(255, self.temps[i] + rnd.choice((-1, 1))))
+
+    def frame(self, kind):
+        if kind == "ce":
+            pct = self.fan_percent[4 if self.booster else self.fan_level]
+            data = [15, 35, 50, 15, 35, 50, pct, pct, self.fan_level, 1, 0, 0, 0, 0]
+            return build_frame(b"\x00\xCE", bytes(data))
+        if kind == "d2":
+            return build_frame(b"\x00\xD2", bytes([self.comfort_raw, *self.temps, 0x0F, 0, 0, 0]))
+        if kind == "e0":
+            return build_frame(b"\x00\xE0", bytes([0, 0, 0, self.bypass, 0, 0, 0]))
+        if kind == "3c":
+            flags = (0x20 if self.filter_full else 0) | (0x08 if self.auto_mode else 0x10)
+            data = [0, flags, 0, 0, 0, 0, 0, 0, 0x78 if self.booster else 0, self.airflow]
+            return build_frame(b"\x00\x3C", bytes(data))
+        if kind == "e2":
+            return build_frame(b"\x00\xE2", bytes([1, 0, 0, 0, 0, 0]))
+        if kind == "ca":
+            return build_frame(b"\x00\xCA", bytes(self.delays))
+        if kind == "de":
+            h = self.hours
+            data = (h[0].to_bytes(3, "big") + h[1].to_bytes(3, "big") + h[2].to_bytes(3, "big")
+                    + b"".join(v.to_bytes(2, "big") for v in h[3:7]) + h[7].to_bytes(3, "big"))
+            return build_frame(b"\x00\xDE", data)
+        if kind == "9c":
+            return build_frame(b"\x00\x9C", bytes([self.rs232_mode]))
+        raise ValueError(kind)
+
+
+class Stats:
+
+    def __init__(self):
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.commands = {}
+        self.acks_received = 0
+        self.faults = {"checksum": 0, "escape": 0, "stall": 0, "disconnect": 0}
+        self.latency = {}    # command -> [count, total s, max s]
+
+    def record(self, name, seconds):
+        entry = self.latency.setdefault(name, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+
+    def report(self):
+        lines = [f"sent {self.frames_sent} frames / {self.bytes_sent} bytes, "
+                 f"{self.acks_received} ACKs received, faults {self.faults}"]
+        for name in sorted(set(self.commands) | set(self.latency)):
+            line = f"  {name:<14}{self.commands.get(name, 0):>6} received"
+            if name in self.latency:
+                n, total, worst = self.latency[name]
+                line += f"  confirm avg {total / n * 1000:7.1f} ms  max {worst * 1000:7.1f} ms"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+class Connection:
+    """One bridge connection: periodic frames, command handling, faults."""
+
+    def __init__(self, unit, stats, args, reader, writer):
+        self.unit = unit
+        self.stats = stats
+        self.args = args
+        self.reader = reader
+        self.writer = writer
+        self.rnd = random.Random(args.seed)
+        self.stalled_until = 0.0
+        self.pending = []          # (command, sent confirm kind, received at)
+        self.parser = CommandParser(self)
+
+    def send(self, kind):
+        frame = self.unit.frame(kind)
+        self.pending_confirm(kind)
+        if time.monotonic() < self.stalled_until:
+            return
+        frame = self.inject(frame)
+        self.writer.write(frame)
+        self.stats.frames_sent += 1
+        self.stats.bytes_sent += len(frame)
+
+    def pending_confirm(self, kind):
+        now = time.monotonic()
+        keep = []
+        for name, confirm, received in self.pending:
+            if confirm == kind:
+                self.stats.record(name, now - received)
+            else:
+                keep.append((name, confirm, received))
+        self.pending = keep
+
+    def inject(self, frame):
+        args, rnd = self.args, self.rnd
+        if args.checksum_errors and rnd.random() < args.checksum_errors:
+            self.stats.faults["checksum"] += 1
+            return frame[:-3] + bytes([frame[-3] ^ 0x5A]) + frame[-2:]
+        if args.bad_escapes and rnd.random() < args.bad_escapes:
+            self.stats.faults["escape"] += 1
+            return frame[:5] + b"\x07\x55" + frame[5:]
+        return frame
+
+    def reply(self, kind, name=None, confirm=None):
+        # the unit answers after its own processing delay
+        if name:
+            self.pending.append((name, confirm or kind, time.monotonic()))
+        asyncio.get_running_loop().call_later(self.args.reply_delay / 1000, self.send, kind)
+
+    def ack(self):
+        self.writer.write(b"\x07\xF3")
+
+    def on_command(self, cmd, data):
+        unit = self.unit
+        name = {
+            b"\x00\x99": "fan_level", b"\x00\xD3": "temperature", b"\x00\x9B": "rs232_mode",
+            b"\x00\xCB": "delay_times", b"\x00\xC9": "get_delays", b"\x00\xDD": "get_hours",
+            b"\x00\x33": "status_poll", b"\x00\x35": "ccease_status", b"\x00\x37": "buttons",
+        }.get(cmd) or REQUESTS.get(cmd, (cmd.hex(),))[0]
+        self.stats.commands[name] = self.stats.commands.get(name, 0) + 1
+
+        if cmd == b"\x00\x99" and data:
+            self.ack()
+            unit.fan_level = data[0]
+            self.reply("ce", name)
+        elif cmd == b"\x00\xD3" and data:
+            self.ack()
+            unit.comfort_raw = data[0]
+            self.reply("d2", name)
+        elif cmd == b"\x00\x9B" and data:
+            self.ack()
+            unit.rs232_mode = 2 if data[0] == 0 else data[0]
+            self.reply("9c", name)
+        elif cmd == b"\x00\xCB" and len(data) >= 8:
+            self.ack()
+            unit.delays = list(data[:8])
+        elif cmd == b"\x00\xC9":
+            self.ack()
+            self.reply("ca", name)
+        elif cmd == b"\x00\xDD":
+            self.ack()
+            self.reply("de", name)
+        elif cmd in REQUESTS:
+            self.ack()
+            self.reply(REQUESTS[cmd][1], name)
+        elif cmd == b"\x00\x33":
+            self.reply("3c")
+        elif cmd == b"\x00\x37" and len(data) >= 7:
+            self.on_buttons(data)
+
+    def on_buttons(self, data):
+        unit = self.unit
+        fan, air, clock = data[0], data[1], data[2]
+        if fan == 0x80:
+            unit.booster = True
+            name = "booster_on"
+        elif fan == 0x06:
+            unit.booster = False
+            name = "booster_off"
+        elif air == 0x06:
+            unit.airflow = AIRFLOW_CYCLE[(AIRFLOW_CYCLE.index(unit.airflow) + 1) % len(AIRFLOW_CYCLE)]
+            name = "airflow_mode"
+        elif air == 0x80:
+            unit.filter_full = False
+            name = "filter_reset"
+        elif clock == 0x06:
+            unit.auto_mode = not unit.auto_mode
+            name = "auto_mode"
+        else:
+            return      # release or button status frame
+        self.stats.commands[name] = self.stats.commands.get(name, 0) + 1
+        self.reply("3c", name)
+
+    async def periodic(self, kind, period):
+        while True:
+            await asyncio.sleep(period)
+            if kind == "d2":
+                self.unit.drift(self.rnd)
+            self.send(kind)
+
+    async def faults(self):
+        args = self.args
+        next_stall = time.monotonic() + args.stall_every if args.stall_every else None
+        next_drop = time.monotonic() + args.disconnect_every if args.disconnect_every else None
+        while True:
+            await asyncio.sleep(0.1)
+            now = time.monotonic()
+            if next_stall and now >= next_stall:
+                self.stats.faults["stall"] += 1
+                self.stalled_until = now + args.stall_for
+                next_stall = now + args.stall_every
+            if next_drop and now >= next_drop:
+                self.stats.faults["disconnect"] += 1
+                self.writer.transport.abort()
+                return
+
+    async def run(self):
+        tasks = [
+            asyncio.create_task(self.periodic(kind, period / self.args.speed))
+            for kind, period in self.periods().items()
+        ]
+        tasks.append(asyncio.create_task(self.faults()))
+        try:
+            while True:
+                data = await self.reader.read(4096)
+                if not data:
+                    break
+                self.stats.acks_received += data.count(b"\x07\xF3")
+                self.parser.feed(data)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.writer.close()
+
+    def periods(self):
+        periods = dict(PERIODS)
+        for spec in self.args.period or ():
+            kind, _, seconds = spec.partition("=")
+            periods[kind.lower()] = float(seconds)
+        return {kind: p for kind, p in periods.items() if p > 0}
+
+
+class CommandParser(ca350.CA350Client):
+    """The bridge's own frame parser, handing commands to the simulator."""
+
+    def __init__(self, conn):
+        super().__init__("sim", 0, None)
+        self.conn = conn
+
+    def handle_frame(self, cmd, length, data, checksum, raw):
+        if self.calc_checksum(cmd, length, data) != checksum:
+            print(f"bad checksum from bridge: {bytes(raw).hex(' ')}")
+            return
+        self.conn.on_command(cmd, bytes(data))
+
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8899)
+    ap.add_argument("--units", type=int, default=1, help="units on consecutive ports")
+    ap.add_argument("--speed", type=float, default=1.0, help="multiply all frame rates")
+    ap.add_argument("--period", action="append", metavar="KIND=SECONDS",
+                    help="override a frame period, e.g. ca=60 or ce=0.2 (0 = on request only)")
+    ap.add_argument("--reply-delay", type=float, default=20, help="ms before answering a command")
+    ap.add_argument("--checksum-errors", type=float, default=0.0, help="share of frames with bad checksum")
+    ap.add_argument("--bad-escapes", type=float, default=0.0, help="share of frames with a broken 07 escape")
+    ap.add_argument("--stall-every", type=float, default=0.0, help="seconds between send stalls")
+    ap.add_argument("--stall-for", type=float, default=5.0, help="length of a stall in seconds")
+    ap.add_argument("--disconnect-every", type=float, default=0.0, help="seconds between dropped connections")
+    ap.add_argument("--stats", type=float, default=0.0, help="print statistics every N seconds")
+    ap.add_argument("--seed", type=int, default=None)
+    args = ap.parse_args()
+
+    stats = Stats()
+
+    def handler(unit):
+        async def handle(reader, writer):
+            peer = writer.get_extra_info("peername")
+            print(f"bridge connected from {peer}", flush=True)
+            await Connection(unit, stats, args, reader, writer).run()
+            print(f"bridge {peer} disconnected")
+        return handle
+
+    servers = [
+        await asyncio.start_server(handler(Unit()), args.host, args.port + n)
+        for n in range(args.units)
+    ]
+    ports = str(args.port) if args.units == 1 else f"{args.port}-{args.port + args.units - 1}"
+    print(f"CA350 simulator listening on {args.host}:{ports}, speed x{args.speed}", flush=True)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async def report():
+        while True:
+            await asyncio.sleep(args.stats)
+            print(stats.report(), flush=True)
+
+    reporter = asyncio.create_task(report()) if args.stats else None
+    await stop.wait()
+    for server in servers:
+        server.close()
+    if reporter:
+        reporter.cancel()
+    print(stats.report())
+
+if __name__ == "__main__":
+    asyncio.run(main())
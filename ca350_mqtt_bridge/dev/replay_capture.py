@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Replay an RX capture (option capture = true) through the bridge's parser
+and decoder, MQTT stubbed out.
+
+    python3 dev/replay_capture.py [--speed 1|100|0] [--profile] ca350_capture.bin.3 ... ca350_capture.bin
+
+Rotated files are replayed in the order given, oldest first. --speed 1
+keeps the original timing, 100 runs 100x faster, 0 (default) feeds the
+chunks as fast as possible. Chunk boundaries are kept as received, so the
+parser sees the same reads as in production.
+"""
+
+import argparse
+import cProfile
+import pstats
+import time
+
+from bench_common import StubMqtt, load_ca350
+
+ca350 = load_ca350()
+
+
+def read_capture(path):
+    """(monotonic timestamp, bytes) per received chunk, empty bytes on (re)connect."""
+    magic = ca350.FrameCapture.MAGIC
+    record = ca350.FrameCapture.RECORD
+    with open(path, "rb") as f:
+        if f.read(len(magic)) != magic:
+            raise SystemExit(f"{path} is not a CA350 capture")
+        while True:
+            head = f.read(record.size)
+            if len(head) < record.size:
+                return
+            ts, n = record.unpack(head)
+            data = f.read(n)
+            if len(data) < n:
+                return      # cut off by a crash or a running capture
+            yield ts, data
+
+
+class ReplayClient(ca350.CA350Client):
+
+    def __init__(self):
+        super().__init__("replay", 0, StubMqtt())
+        self.frames = {}
+
+    def handle_frame(self, cmd, length, data, checksum, raw):
+        self.frames[cmd] = self.frames.get(cmd, 0) + 1
+        super().handle_frame(cmd, length, data, checksum, raw)
+
+
+def replay(paths, speed):
+    client = ReplayClient()
+    chunks = nbytes = connects = 0
+    first = last = None
+    t0 = time.perf_counter()
+    for path in paths:
+        for ts, data in read_capture(path):
+            if first is None:
+                first = ts
+            last = ts
+            if speed:
+                delay = (ts - first) / speed - (time.perf_counter() - t0)
+                if delay > 0:
+                    time.sleep(delay)
+            if not data:
+                connects += 1
+                continue
+            chunks += 1
+            nbytes += len(data)
+            client.feed(data)
+    wall = time.perf_counter() - t0
+    return client, {
+        "captured_s": (last - first) if first is not None else 0.0,
+        "replay_s": wall,
+        "chunks": chunks,
+        "bytes": nbytes,
+        "connects": connects,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--speed", type=float, default=0, help="1 = real time, 100 = 100x, 0 = max")
+    ap.add_argument("--profile", action="store_true", help="print the top functions by cumulative time")
+    ap.add_argument("captures", nargs="+")
+    args = ap.parse_args()
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        client, r = profiler.runcall(replay, args.captures, args.speed)
+    else:
+        client, r = replay(args.captures, args.speed)
+
+    frames = sum(client.frames.values())
+    print(f"captured {r['captured_s']:.1f} s, replayed in {r['replay_s']:.3f} s, "
+          f"{r['chunks']} chunks / {r['bytes']} bytes, {r['connects']} connects")
+    print(f"{frames} frames, {client.checksum_errors} checksum errors, "
+          f"{client.rx_resyncs} resyncs, {client.rx_dropped} bytes dropped")
+    print(f"{client.mqtt.publish_calls} publishes, {client.state.suppressed_count} suppressed")
+    for cmd, count in sorted(client.frames.items()):
+        print(f"  {cmd.hex()}  {count:>8}")
+
+    if args.profile:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,4 +9,5 @@ export MQTT_PORT=$(bashio::services mqtt | jq -r '.port')
 export MQTT_USER=$(bashio::services mqtt | jq -r '.username')
 export MQTT_PASS=$(bashio::services mqtt | jq -r '.password')
 
-python3 /app/ca350.py
+# exec: SIGTERM from the Supervisor reaches the bridge, state is saved on stop
+exec python3 /app/ca350.py